@@ -1,10 +1,25 @@
 from __future__ import absolute_import
-from . import core
+import sqlalchemy
+from . import core, config
+from .core import data_attribute_mapper
+
+class LinkTarget(object):
+    """Stands in for the Halo object that a link points to, identifying it only by id.
+
+    This allows links to be passed to insert_list without loading the target halos."""
+    def __init__(self, halo_id):
+        self.halo_id = halo_id
+
+def _is_link_target(prop):
+    return isinstance(prop, (core.halo.Halo, LinkTarget))
 
 def create_property(halo, name, prop, session):
 
     name = core.dictionary.get_or_create_dictionary_item(session, name)
 
+    if isinstance(prop, LinkTarget):
+        prop = session.query(core.halo.Halo).filter_by(id=prop.halo_id).first()
+
     if isinstance(prop, core.halo.Halo):
         px = core.halo_data.HaloLink(halo, prop, name)
     else:
@@ -14,23 +29,94 @@ def create_property(halo, name, prop, session):
     return px
 
 
-def _insert_list_unlocked(property_list):
-    session = core.get_default_session()
+class _PackedPropertyData(object):
+    """Receives the data attributes of a HaloProperty without constructing the ORM object"""
+    def __init__(self):
+        self.data_float = None
+        self.data_int = None
+        self.data_array = None
+
+def _id_of(halo):
+    if isinstance(halo, core.halo.Halo):
+        # use the identity key rather than halo.id, which would issue a query per halo if the object is expired
+        identity = sqlalchemy.inspect(halo).identity
+        return None if identity is None else identity[0]
+    elif isinstance(halo, LinkTarget):
+        return halo.halo_id
+    else:
+        return halo
+
+def _can_bulk_insert(property_list):
+    if not config.bulk_insert:
+        return False
+    for halo, name, prop in property_list:
+        # objects not yet flushed to the database have no id for us to refer to
+        if _id_of(halo) is None:
+            return False
+        if _is_link_target(prop) and _id_of(prop) is None:
+            return False
+    return True
+
+def _property_and_link_rows(property_list, session, creator_id):
+    name_objs = core.dictionary.get_or_create_dictionary_items(session, [p[1] for p in property_list])
+    name_ids = {name: obj.id for name, obj in name_objs.items()}
+
+    property_rows = []
+    link_rows = []
+    for halo, name, prop in property_list:
+        if _is_link_target(prop):
+            link_rows.append({'halo_from_id': _id_of(halo), 'halo_to_id': _id_of(prop), 'weight': 1.0,
+                              'relation_id': name_ids[name], 'creator_id': creator_id})
+        else:
+            packed = _PackedPropertyData()
+            data_attribute_mapper.set_data_of_unknown_type(packed, prop)
+            property_rows.append({'halo_id': _id_of(halo), 'name_id': name_ids[name], 'creator_id': creator_id,
+                                  'deprecated': False, 'data_float': packed.data_float,
+                                  'data_int': packed.data_int, 'data_array': packed.data_array})
+    return property_rows, link_rows
+
+def _execute_in_chunks(session, statement, rows):
+    chunk_size = config.bulk_insert_chunk_size
+    for start in range(0, len(rows), chunk_size):
+        session.execute(statement, rows[start:start+chunk_size])
 
+def _bulk_insert_list_unlocked(property_list, session, creator_id):
+    # the dictionary lookups (and any resulting commits) all happen before the row construction, so that
+    # the final transaction consists only of the inserts
+    property_rows, link_rows = _property_and_link_rows(property_list, session, creator_id)
+
+    _execute_in_chunks(session, core.halo_data.HaloProperty.__table__.insert(), property_rows)
+    _execute_in_chunks(session, core.halo_data.HaloLink.__table__.insert(), link_rows)
+
+    session.commit()
+
+def _orm_insert_list_unlocked(property_list, session, creator_id):
     property_object_list = [create_property(
-        p[0], p[1], p[2], session) for p in property_list if p[2] is not None]
+        p[0], p[1], p[2], session) for p in property_list]
+
+    for p in property_object_list:
+        p.creator_id = creator_id
 
     session.add_all(property_object_list)
 
     session.commit()
 
-def insert_list(property_list):
+def _insert_list_unlocked(property_list, session=None, creator_id=None):
+    if session is None:
+        session = core.get_default_session()
+    if creator_id is None:
+        creator_id = core.creator.get_creator_id()
+    property_list = [p for p in property_list if p[2] is not None]
+    if _can_bulk_insert(property_list):
+        _bulk_insert_list_unlocked(property_list, session, creator_id)
+    else:
+        _orm_insert_list_unlocked(property_list, session, creator_id)
+
+def insert_list(property_list, session=None, creator_id=None):
     from tangos import parallel_tasks as pt
 
     if pt.backend!=None:
         with pt.ExclusiveLock("insert_list"):
-            _insert_list_unlocked(property_list)
+            _insert_list_unlocked(property_list, session, creator_id)
     else:
-        _insert_list_unlocked(property_list)
-
-
+        _insert_list_unlocked(property_list, session, creator_id)
@@ -48,6 +48,47 @@ mergertree_max_hops = 500 # maximum number of timesteps to scan
 num_multihops_max_default = 100     # the maximum number of links to follow when searching for related halos
 max_relative_time_difference = 1e-4     # the maximum fractional difference in time between two contemporaneous timesteps when searching for related halos
 
+# storage format for numeric arrays. 'columnar' stores the raw buffer, which decodes without copying or unpickling;
+# 'pickle' reproduces the format used by older versions of tangos. Either can always be read.
+array_storage_format = 'columnar'
+
+# when writing properties, insert rows directly rather than via ORM objects; this greatly reduces the time for
+# which the database lock is held. The ORM path is still used for objects which have not yet been flushed.
+bulk_insert = True
+bulk_insert_chunk_size = 5000 # number of rows per executemany statement
+
+# when writing asynchronously (tangos write --async-write), the number of rows the writer may fall behind before
+# ranks sending further results are made to wait
+async_writer_max_queue_rows = 100000
+
+# parallel_tasks.distributed hands out jobs in chunks that shrink as the list drains (guided self-scheduling); each
+# chunk is about 1/parallel_job_chunk_factor of a rank's fair share of the remaining work. Set to None to hand out
+# one job at a time.
+parallel_job_chunk_factor = 2
+
+# the pynbody server (tangos write --load-mode server) holds up to pynbody_server_max_snapshots snapshots in memory,
+# so that clients working on different timesteps need not wait for each other. Loading stops short of this number if
+# the snapshots already held have realised more than pynbody_server_memory_budget bytes of arrays (None for no limit).
+pynbody_server_max_snapshots = 1
+pynbody_server_memory_budget = None
+
+# evaluate calculate_all on stored scalar properties and simple arithmetic directly from a single SQL query,
+# without loading halo objects
+calculate_all_fast_path = True
+
+# where the database supports it, follow major progenitor and descendant branches with a single recursive query
+# rather than a few statements per hop
+multihop_recursive_query = True
+
+# follow links within a simulation using an in-memory index of the halolink table (see
+# relation_finding.link_graph), which is built on first use for each simulation. This is faster for repeated
+# relation finding, at the cost of memory.
+use_link_graph = False
+
+# read major progenitor branches from the precomputed main_branch table, where it has been built (by tangos
+# build-branches) and is up to date
+use_main_branch_index = True
+
 # On some network file systems, concurrency using sqlite is dodgy to say the least. After committing a transaction
 # on one node, and before attempting to open a new transaction on another node, it seems empirically helpful to
 # allow a significant time delay. This variable controls that delay.
@@ -47,6 +47,7 @@ from .tracking import TrackData, update_tracker_halos
 from .timestep import TimeStep
 from .halo import Halo
 from .halo_data import HaloProperty, HaloLink
+from .main_branch import MainBranchEntry, MainBranchBuild
 
 Index("halo_index", HaloProperty.__table__.c.halo_id)
 Index("name_halo_index", HaloProperty.__table__.c.name_id,
@@ -57,6 +58,7 @@ Index("halo_finder_index", Halo.__table__.c.finder_id)
 Index("haloproperties_creator_index", HaloProperty.__table__.c.creator_id)
 Index("halolink_index", HaloLink.__table__.c.halo_from_id)
 Index("named_halolink_index", HaloLink.__table__.c.relation_id, HaloLink.__table__.c.halo_from_id)
+Index("main_branch_halo_index", MainBranchEntry.__table__.c.halo_id)
 
 
 
@@ -133,7 +135,8 @@ def init_db(db_uri=None, timeout=30, verbose=None):
     creator.set_creator(None)
 
 
-from .dictionary import _get_dict_cache_for_session, get_dict_id, get_or_create_dictionary_item
+from .dictionary import _get_dict_cache_for_session, get_dict_id, get_or_create_dictionary_item, \
+    get_or_create_dictionary_items
 
 
 
@@ -10,7 +10,14 @@ import datetime
 import six
 import sys
 import functools
+import struct
 from six.moves import cPickle as pickle
+from .. import config
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
 
 pickle_loads = pickle.loads
 if int(sys.version[0])==3:
@@ -19,6 +26,28 @@ if int(sys.version[0])==3:
 
 _THRESHOLD_FOR_COMPRESSION = 1000
 
+_COLUMNAR_NO_COMPRESSION = 0
+_COLUMNAR_ZLIB = 1
+_COLUMNAR_LZ4 = 2
+_COLUMNAR_HEADER = struct.Struct("<BBB") # compressor code, length of dtype string, number of dimensions
+_COLUMNAR_DIMENSION_SIZE = 8
+_COLUMNAR_MAX_COMPRESSION_RATIO = 0.8
+
+_columnar_dtypes = {}
+_columnar_shape_structs = {}
+
+def _columnar_dtype(dtype_str):
+    dtype = _columnar_dtypes.get(dtype_str, None)
+    if dtype is None:
+        dtype = _columnar_dtypes[dtype_str] = np.dtype(dtype_str.decode('ascii'))
+    return dtype
+
+def _columnar_shape_struct(ndim):
+    shape_struct = _columnar_shape_structs.get(ndim, None)
+    if shape_struct is None:
+        shape_struct = _columnar_shape_structs[ndim] = struct.Struct("<%dQ"%ndim)
+    return shape_struct
+
 def get_data_of_unknown_type(obj):
     """Starting from the ORM object, extract data which may be stored in a variety of attributes depending on its type"""
     mapper = DataAttributeMapper(db_object=obj)
@@ -153,6 +182,19 @@ class IntAttributeMapper(ArrayDowncastingAttributeMapper):
 
 
 class ArrayAttributeMapper(DataAttributeMapper):
+    """Stores arrays as binary blobs.
+
+    Several formats are understood, distinguished by a two-byte header:
+
+     * ``CX`` - columnar format: the dtype and shape are followed by the raw array buffer (optionally compressed),
+       which can be decoded with np.frombuffer without unpickling. Used for plain numeric numpy arrays when
+       config.array_storage_format is 'columnar'.
+     * ``ZX`` - zlib-compressed pickle
+     * ``PX`` - uncompressed pickle
+     * no header - very old format, a raw float64 buffer
+
+    Arrays decoded from the columnar format are writable, like those unpickled from the other formats.
+    """
     _attribute_name = "data_array"
     _handled_types = [list, np.ndarray]
     _order = 1 # must be used only when downcasting mappers have failed
@@ -166,9 +208,36 @@ class ArrayAttributeMapper(DataAttributeMapper):
     def _unpack_old_format(self, packed):
         return np.frombuffer(packed)
 
+    def _unpack_columnar(self, packed):
+        compressor, dtype_len, ndim = _COLUMNAR_HEADER.unpack_from(packed, 2)
+        offset = 2+_COLUMNAR_HEADER.size
+        dtype = _columnar_dtype(packed[offset:offset+dtype_len])
+        offset+=dtype_len
+        if ndim!=1:
+            shape = _columnar_shape_struct(ndim).unpack_from(packed, offset)
+        offset+=ndim*_COLUMNAR_DIMENSION_SIZE
+
+        if compressor==_COLUMNAR_NO_COMPRESSION:
+            # packed is immutable, so the array must be copied out of it to be writable
+            result = np.frombuffer(packed, dtype=dtype, offset=offset).copy()
+        elif compressor==_COLUMNAR_ZLIB:
+            result = np.frombuffer(bytearray(zlib.decompress(packed[offset:])), dtype=dtype)
+        elif compressor==_COLUMNAR_LZ4:
+            if lz4_frame is None:
+                raise IOError("This array was stored using lz4 compression, but the lz4 module is not available")
+            result = np.frombuffer(lz4_frame.decompress(packed[offset:], return_bytearray=True), dtype=dtype)
+        else:
+            raise ValueError("Unknown compression code %d in columnar array data"%compressor)
+
+        if ndim!=1:
+            result = result.reshape(shape)
+        return result
+
     def unpack(self, packed):
         if len(packed)==0:
             return None
+        elif packed.startswith(b"CX"):
+            return self._unpack_columnar(packed)
         elif packed.startswith(b"ZX"):
             return self._unpack_compressed(packed)
         elif packed.startswith(b"PX"):
@@ -176,7 +245,30 @@ class ArrayAttributeMapper(DataAttributeMapper):
         else:
             return self._unpack_old_format(packed)
 
-    def pack(self, data):
+    @staticmethod
+    def _can_pack_columnar(data):
+        # subclasses such as SimArray carry extra information (e.g. units) that only survives pickling
+        return config.array_storage_format=='columnar' and type(data) is np.ndarray \
+               and data.dtype.kind in 'biufc'
+
+    def _pack_columnar(self, data):
+        data = np.ascontiguousarray(data)
+        dtype_str = data.dtype.str.encode('ascii')
+        raw = data.tobytes()
+        compressor = _COLUMNAR_NO_COMPRESSION
+        if len(raw) > _THRESHOLD_FOR_COMPRESSION:
+            if lz4_frame is not None:
+                compressed, compressed_code = lz4_frame.compress(raw), _COLUMNAR_LZ4
+            else:
+                compressed, compressed_code = zlib.compress(raw, 1), _COLUMNAR_ZLIB
+            # data such as random floats barely compress, and are then quicker to read uncompressed
+            if len(compressed) < _COLUMNAR_MAX_COMPRESSION_RATIO*len(raw):
+                raw, compressor = compressed, compressed_code
+        header = _COLUMNAR_HEADER.pack(compressor, len(dtype_str), data.ndim)
+        shape = _columnar_shape_struct(data.ndim).pack(*data.shape)
+        return b"CX" + header + dtype_str + shape + raw
+
+    def _pack_pickle(self, data):
         dumped_st = pickle.dumps(data)
         if len(dumped_st) > _THRESHOLD_FOR_COMPRESSION:
             dumped_st = b"ZX" + zlib.compress(dumped_st)
@@ -184,6 +276,28 @@ class ArrayAttributeMapper(DataAttributeMapper):
             dumped_st = b"PX" + dumped_st
         return dumped_st
 
+    def pack(self, data):
+        if self._can_pack_columnar(data):
+            return self._pack_columnar(data)
+        else:
+            return self._pack_pickle(data)
+
+
+def repack_array(packed):
+    """Re-encode a stored array blob in the currently preferred format.
+
+    Returns the new blob, or None if the blob is empty or re-encoding would leave it unchanged in format."""
+    if packed is None or len(packed)==0:
+        return None
+    mapper = object.__new__(ArrayAttributeMapper)
+    data = mapper.unpack(packed)
+    if data is None:
+        return None
+    repacked = mapper.pack(data)
+    if repacked[:2]==bytes(packed[:2]):
+        return None
+    return repacked
+
 
 # Following must be defined last to act as a fall-through:
 class NullAttributeMapper(DataAttributeMapper):
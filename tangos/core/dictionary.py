@@ -1,11 +1,18 @@
 from __future__ import absolute_import
+import weakref
 import sqlalchemy, sqlalchemy.exc
 from sqlalchemy import Column, Integer, String
 
 from . import Base, get_default_session
 
-_dict_id = {}  # maps dictionary text -> database ID
-_dict_obj = {} # maps session, dictionary text -> database object
+# The mapping from text to ID never changes once an item is created, so is shared between all sessions using the same
+# engine. When a session first consults the cache, the row count and maximum ID in the table are compared with those
+# of the cache, and the table is reloaded only if they disagree.
+_dict_id = weakref.WeakKeyDictionary()  # maps engine -> {dictionary text -> database ID}
+_dict_id_validated_sessions = weakref.WeakKeyDictionary() # sessions for which the above check has been made
+_dict_obj = weakref.WeakKeyDictionary() # maps session -> {dictionary text -> database object}
+
+_MAX_NAMES_PER_QUERY = 500
 
 
 class DictionaryItem(Base):
@@ -34,28 +41,26 @@ def get_dict_id(text, default=raise_exception, session=None, allow_query=True):
     from . import Session
 
     if session is None:
-        session = Session()
-        _dict_id = _get_dict_cache_for_session(get_default_session())
-        close_session=True
+        dict_cache = _get_dict_cache_for_session(get_default_session())
     else:
-        _dict_id = _get_dict_cache_for_session(session)
-        close_session=False
+        dict_cache = _get_dict_cache_for_session(session)
 
     try:
-        return _dict_id[text]
+        return dict_cache[text]
     except KeyError:
 
         if allow_query:
+            query_session = Session() if session is None else session
             try:
-                obj = session.query(DictionaryItem).filter_by(text=text).first()
+                obj = query_session.query(DictionaryItem).filter_by(text=text).first()
             except:
                 if default is raise_exception:
                     raise
                 else:
                     return default
             finally:
-                if close_session:
-                    session.close()
+                if session is None:
+                    query_session.close()
         else:
             obj = None
 
@@ -65,7 +70,7 @@ def get_dict_id(text, default=raise_exception, session=None, allow_query=True):
             else:
                 return default
 
-        _dict_id[text] = obj.id
+        dict_cache[text] = obj.id
         return obj.id
 
 def get_or_create_dictionary_item(session, name):
@@ -75,46 +80,86 @@ def get_or_create_dictionary_item(session, name):
     locked under the specified session* to prevent duplicate items
     being created"""
 
-    if session not in _dict_obj:
-        _dict_obj[session] = {}
-
     # try to get it from the cache
-    obj = _dict_obj[session].get(name, None)
+    obj = _dict_obj.get(session, {}).get(name, None)
 
     if obj is not None:
         return obj
 
-    # try to get it from the db
-    obj = session.query(DictionaryItem).filter_by(text=name).first()
+    return get_or_create_dictionary_items(session, [name])[name]
+
+def _query_dictionary_items(session, names):
+    results = {}
+    for start in range(0, len(names), _MAX_NAMES_PER_QUERY):
+        for obj in session.query(DictionaryItem).filter(DictionaryItem.text.in_(names[start:start+_MAX_NAMES_PER_QUERY])):
+            results[obj.text] = obj
+    return results
 
+def get_or_create_dictionary_items(session, names):
+    """Get the DictionaryItems corresponding to each of names, returning a dictionary mapping name -> DictionaryItem.
 
-    if obj is None:
-        # try to create it
+    Any that do not yet exist are created, all in a single transaction. As for get_or_create_dictionary_item,
+    this must be called while the database is locked under the specified session."""
+
+    session_objs = _dict_obj.setdefault(session, {})
+    results = {}
+    missing = []
+    for name in set(names):
+        obj = session_objs.get(name, None)
+        if obj is None:
+            missing.append(name)
+        else:
+            results[name] = obj
+
+    if len(missing)==0:
+        return results
+
+    found = _query_dictionary_items(session, missing)
+    to_create = [name for name in missing if name not in found]
+
+    while len(to_create)>0:
         try:
-            obj = DictionaryItem(name)
-            obj = session.merge(obj)
+            session.add_all([DictionaryItem(name) for name in to_create])
             session.commit()
+            created = True
         except sqlalchemy.exc.IntegrityError:
+            # another process created some of the items in the meantime, and the whole batch was rolled back
             session.rollback()
-            obj = session.query(DictionaryItem).filter_by(text=name).first()
-            if obj is None:
-                raise # can't get it from the DB, can't create it from the DB... who knows...
+            created = False
+        # the commit expired all objects; re-querying refreshes them in one go rather than one at a time
+        found = _query_dictionary_items(session, missing)
+        still_to_create = [name for name in missing if name not in found]
+        if len(still_to_create)>0 and (created or len(still_to_create)==len(to_create)):
+            # retrying cannot help unless some of the names were created by another process
+            raise RuntimeError("Unable to create dictionary items for %s"%(", ".join(still_to_create)))
+        to_create = still_to_create
 
-    _dict_obj[session][name] = obj
-    return obj
+    results.update(found)
+    session_objs.update(found)
 
-def _get_dict_cache_for_session(session):
-    session_dict = _dict_id.get(session, None)
-    if session_dict is None:
-        session_dict = {}
-        for dict_item in session.query(DictionaryItem):
-            session_dict[dict_item.text] = dict_item.id
+    dict_cache = _dict_id.get(session.get_bind(), None)
+    if dict_cache is not None:
+        for name, obj in found.items():
+            dict_cache[name] = obj.id
 
-        _dict_id[session] = session_dict
+    return results
 
-    return session_dict
+def _get_dict_cache_for_session(session):
+    engine = session.get_bind()
+    if session not in _dict_id_validated_sessions:
+        cache = _dict_id.get(engine, None)
+        n_rows, max_id = session.query(sqlalchemy.func.count(DictionaryItem.id),
+                                       sqlalchemy.func.max(DictionaryItem.id)).one()
+        if cache is None or len(cache)!=n_rows or (n_rows>0 and max(cache.values())!=max_id):
+            cache = {}
+            for text, id in session.query(DictionaryItem.text, DictionaryItem.id):
+                cache[text] = id
+            _dict_id[engine] = cache
+        _dict_id_validated_sessions[session] = True
+
+    return _dict_id[engine]
 
 def get_lexicon(session):
     """Get a list of all strings known in the dictionary table"""
     dict_cache = _get_dict_cache_for_session(session)
-    return dict_cache.keys()
\ No newline at end of file
+    return dict_cache.keys()
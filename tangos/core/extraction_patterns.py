@@ -5,6 +5,8 @@ from __future__ import absolute_import
 import sqlalchemy
 from . import data_attribute_mapper
 
+_MAX_IDS_PER_QUERY = 500 # keeps IN clauses within the limits of older sqlite versions
+
 
 class HaloPropertyGetter(object):
     """HaloPropertyGetter and its subclasses implement efficient methods for retrieving data from sqlalchemy ORM objects.
@@ -18,6 +20,9 @@ class HaloPropertyGetter(object):
 
     This base class is used to retrieve the actual HaloProperty objects.
     """
+    _cache_attribute = 'all_properties' # the in-memory cache of objects
+    _cache_name_id_attribute = 'name_id' # the attribute of the cached objects identifying their name
+
     def use_fixed_cache(self, halo):
         return 'all_properties' not in sqlalchemy.inspect(halo).unloaded
 
@@ -52,13 +57,33 @@ class HaloPropertyGetter(object):
         :type halo: Halo
         :type property_id: int"""
 
-        return_vals = []
+        return self.postprocess_data_objects(self._cache_index(halo).get(property_id, []))
+
+    def get_from_cache_or_session_for_halos(self, halos, property_id, session):
+        """Get the specified property for each of a list of halos, as a list of lists.
+
+        Halos with an in-memory cache are served from the cache; otherwise, the cache is loaded from the database.
+        Subclasses may override this to retrieve the data for many halos in bulk.
+
+        :type halos: list of Halo
+        :type property_id: int
+        :type session: sqlalchemy.orm.session.Session"""
+        return [self.get_from_cache(h, property_id) for h in halos]
 
-        for x in halo.all_properties:
-            if x.name_id == property_id:
-                return_vals.append(x)
+    def _cache_index(self, halo):
+        """Return a dictionary mapping name ids onto lists of objects in the in-memory cache of halo.
 
-        return self.postprocess_data_objects(return_vals)
+        The dictionary is built once and then re-used until the in-memory cache itself changes, so that
+        looking up many properties for one halo does not require repeated scans of the cache."""
+        collection = getattr(halo, self._cache_attribute)
+        indices = halo.__dict__.setdefault('_extraction_pattern_indices', {})
+        indexed_collection, indexed_length, index = indices.get(self._cache_attribute, (None, None, None))
+        if indexed_collection is not collection or indexed_length!=len(collection):
+            index = {}
+            for x in collection:
+                index.setdefault(getattr(x, self._cache_name_id_attribute), []).append(x)
+            indices[self._cache_attribute] = (collection, len(collection), index)
+        return index
 
 
     def get_from_session(self, halo, property_id, session):
@@ -91,11 +116,7 @@ class HaloPropertyGetter(object):
         :type halo: Halo
         :type property_id: int"""
 
-        for x in halo.all_properties:
-            if x.name_id == property_id:
-                return True
-
-        return False
+        return property_id in self._cache_index(halo)
 
     def postprocess_data_objects(self, objects):
         """Post-process the ORM data objects to pull out the data in the form required"""
@@ -126,6 +147,65 @@ class HaloPropertyValueGetter(HaloPropertyGetter):
             except NameError:
                 pass
 
+    def _infer_property_class_from_id(self, halo, property_id, session):
+        if self._providing_class is None:
+            from .dictionary import DictionaryItem
+            name = session.query(DictionaryItem).filter_by(id=property_id).first()
+            try:
+                self._providing_class = name.providing_class(halo.handler_class)
+            except NameError:
+                pass
+
+    def _requires_reassembly(self, halo, property_id, session):
+        self._infer_property_class_from_id(halo, property_id, session)
+        return hasattr(self._providing_class, 'reassemble')
+
+    def get_from_cache_or_session_for_halos(self, halos, property_id, session):
+        """Get the specified property for each of a list of halos, as a list of lists.
+
+        Halos without an in-memory cache have their data fetched with a single query (per few hundred halos),
+        bypassing the construction of ORM objects, unless the property needs to be reassembled."""
+        results = [None]*len(halos)
+        uncached = []
+        for i, h in enumerate(halos):
+            if self.use_fixed_cache(h):
+                results[i] = self.get_from_cache(h, property_id)
+            else:
+                uncached.append(i)
+
+        if len(uncached)>0:
+            uncached_halos = [halos[i] for i in uncached]
+            if self._requires_reassembly(uncached_halos[0], property_id, session):
+                fetched = super(HaloPropertyValueGetter, self).get_from_cache_or_session_for_halos(uncached_halos,
+                                                                                               property_id, session)
+            else:
+                fetched = self._get_raw_values_from_session_for_halos(uncached_halos, property_id, session)
+            for i, fetched_i in zip(uncached, fetched):
+                results[i] = fetched_i
+
+        return results
+
+    def _get_raw_values_from_session_for_halos(self, halos, property_id, session):
+        from . import halo_data
+        table = halo_data.HaloProperty.__table__
+        halo_ids = [h.id for h in halos]
+        rows_by_halo_id = {}
+        for start in range(0, len(halo_ids), _MAX_IDS_PER_QUERY):
+            # a column-only query returns plain tuples, but unlike session.execute still autoflushes pending objects
+            query = session.query(table.c.halo_id, table.c.data_float, table.c.data_int, table.c.data_array).\
+                filter((table.c.name_id==property_id) & table.c.halo_id.in_(halo_ids[start:start+_MAX_IDS_PER_QUERY])).\
+                order_by(table.c.id)
+            for row in query:
+                rows_by_halo_id.setdefault(row.halo_id, []).append(row)
+
+        results = []
+        for halo_id in halo_ids:
+            rows = rows_by_halo_id.get(halo_id, [])
+            for row in rows:
+                self._setup_data_mapper(row)
+            results.append([self._mapper.get(row) for row in rows])
+        return results
+
     def _postprocess_one_result(self, property_object):
         self._infer_property_class(property_object)
 
@@ -146,6 +226,9 @@ class HaloPropertyValueWithReassemblyOptionsGetter(HaloPropertyValueGetter):
 
 class HaloPropertyRawValueGetter(HaloPropertyValueGetter):
     """As HaloPropertyValueGetter, but never invoke an automatic reassembly; always retrieve the raw data"""
+    def _requires_reassembly(self, halo, property_id, session):
+        return False
+
     def _postprocess_one_result(self, property_object):
         self._setup_data_mapper(property_object)
         return self._mapper.get(property_object)
@@ -154,14 +237,8 @@ class HaloPropertyRawValueGetter(HaloPropertyValueGetter):
 
 class HaloLinkGetter(HaloPropertyGetter):
     """As HaloPropertyGetter, but retrieve HaloLinks instead of HaloProperties"""
-    def get_from_cache(self, halo, property_id):
-        return_vals = []
-
-        for x in halo.all_links:
-            if x.relation_id == property_id:
-                return_vals.append(x)
-
-        return self.postprocess_data_objects(return_vals)
+    _cache_attribute = 'all_links'
+    _cache_name_id_attribute = 'relation_id'
 
     def get_from_session(self, halo, property_id, session):
         from . import halo_data
@@ -169,13 +246,6 @@ class HaloLinkGetter(HaloPropertyGetter):
             halo_data.HaloLink.id)
         return self.postprocess_data_objects(query_links.all())
 
-    def cache_contains(self, halo, property_id):
-        for x in halo.all_links:
-            if x.relation_id == property_id:
-                return True
-
-        return False
-
     def keys_from_cache(self, halo):
         """Return a list of keys from an existing in-memory cache"""
         return [x.relation.text for x in halo.all_links]
@@ -0,0 +1,80 @@
+"""A precomputed index of the major progenitor branches in each simulation.
+
+Each halo in an indexed simulation belongs to at least one branch. A branch starts from a root halo that is not the
+major progenitor of anything, and lists the chain of major progenitors behind it, each at depth one greater than the
+last. The major progenitors of any halo in a branch are therefore the entries of that branch at greater depth, which
+can be retrieved with a single indexed range query.
+
+The index is built by the build-branches tool (tools.main_branch_builder) and used by
+MultiHopMajorProgenitorsStrategy. It becomes out of date, and is then ignored, when links from the simulation are
+added or removed (see get_link_signature)."""
+
+from __future__ import absolute_import
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, Float, ForeignKey
+from sqlalchemy.orm import relationship, backref
+
+from . import Base
+from .halo import Halo
+from .simulation import Simulation
+from .halo_data import HaloLink
+from .timestep import TimeStep
+
+
+class MainBranchEntry(Base):
+    __tablename__ = 'main_branch'
+
+    root_id = Column(Integer, primary_key=True, autoincrement=False)
+    depth = Column(Integer, primary_key=True, autoincrement=False)
+
+    halo_id = Column(Integer, ForeignKey('halos.id'))
+    halo = relationship(Halo, backref=backref('main_branch_entries', cascade='all, delete-orphan', lazy='dynamic'),
+                        cascade='')
+
+    timestep_id = Column(Integer)
+
+    # the weight of the link from the entry at the previous depth to this one (1.0 for the root)
+    weight = Column(Float)
+
+    def __repr__(self):
+        return "<MainBranchEntry root=%d depth=%d halo=%d>"%(self.root_id, self.depth, self.halo_id)
+
+
+class MainBranchBuild(Base):
+    __tablename__ = 'main_branch_builds'
+
+    simulation_id = Column(Integer, ForeignKey('simulations.id'), primary_key=True, autoincrement=False)
+    simulation = relationship(Simulation, backref=backref('main_branch_build', cascade='all, delete-orphan',
+                                                          lazy='dynamic'), cascade='')
+
+    # the number of links from the simulation, and their maximum id, at the time the index was built
+    link_count = Column(Integer)
+    max_link_id = Column(Integer)
+
+    def __repr__(self):
+        return "<MainBranchBuild simulation=%d>"%self.simulation_id
+
+
+def get_link_signature(session, simulation_id):
+    """Return (number of links, maximum link id) for the links originating in the specified simulation.
+
+    Any addition of links increases the maximum id and any removal decreases the number of links, so a change in
+    the signature reveals that the links have changed."""
+    count, max_id = session.query(sqlalchemy.func.count(HaloLink.id), sqlalchemy.func.max(HaloLink.id)).\
+        join(Halo, HaloLink.halo_from_id==Halo.id).join(TimeStep, Halo.timestep_id==TimeStep.id).\
+        filter(TimeStep.simulation_id==simulation_id).one()
+    return count, max_id
+
+def main_branch_index_is_current(session, simulation_id):
+    """Return True if the main branch index for the specified simulation exists and is up to date"""
+    build = session.query(MainBranchBuild.link_count, MainBranchBuild.max_link_id).\
+        filter(MainBranchBuild.simulation_id==simulation_id).first()
+    if build is None:
+        return False
+    return tuple(build)==get_link_signature(session, simulation_id)
+
+def get_main_branch_position(session, halo_id):
+    """Return (root_id, depth) for one of the branches containing the specified halo, or None"""
+    return session.query(MainBranchEntry.root_id, MainBranchEntry.depth).\
+        filter(MainBranchEntry.halo_id==halo_id).first()
@@ -122,7 +122,8 @@ class TimeStep(Base):
         :param limit: maximum number of objects to use. If None (default), all are included.
         """
 
-        from .. import live_calculation
+        from .. import live_calculation, config
+        from ..live_calculation import scalar_fast_path
         from . import Session
         from .halo import Halo
 
@@ -137,6 +138,11 @@ class TimeStep(Base):
         else:
             property_description = live_calculation.parser.parse_property_names(*plist)
 
+        if config.calculate_all_fast_path:
+            calculation_results = scalar_fast_path.calculate_all(self, property_description, object_typecode, limit)
+            if calculation_results is not None:
+                return calculation_results
+
         # must be performed in its own session as we intentionally load in a lot of
         # objects with incomplete lazy-loaded properties
         session = Session()
@@ -6,7 +6,7 @@ from __future__ import absolute_import
 import warnings
 
 import numpy as np
-from sqlalchemy.orm import contains_eager, aliased, defaultload
+from sqlalchemy.orm import contains_eager, aliased, defaultload, object_session
 
 import tangos.core.dictionary
 import tangos.core.halo
@@ -675,16 +675,19 @@ class StoredProperty(Calculation):
     def values(self, halos):
         self._name_id = tangos.core.dictionary.get_dict_id(self._name)
         ret = np.empty((1,len(halos)),dtype=object)
-        for i, h in enumerate(halos):
-            if self._extraction_pattern.cache_contains(h, self._name_id):
+        if len(halos)==0:
+            return ret
+        session = object_session(halos[0])
+        all_matches = self._extraction_pattern.get_from_cache_or_session_for_halos(halos, self._name_id, session)
+        for i, matches in enumerate(all_matches):
+            if len(matches)>0:
                 if self._multivalued:
-                    ret[0,i]=self._extraction_pattern.get_from_cache(h, self._name_id)
+                    ret[0, i] = matches
                 else:
-                    ret[0, i] = self._extraction_pattern.get_from_cache(h, self._name_id)[0]
+                    ret[0, i] = matches[0]
         return ret
 
     def values_and_description(self, halos):
-        from .. import properties
         values = self.values(halos)
         if len(halos)==0:
             # cannot build a meaningful property description as we don't have any halos, therefore don't know
@@ -692,6 +695,11 @@ class StoredProperty(Calculation):
             return values, None
 
         sim = consistent_collection.consistent_simulation_from_halos(halos)
+        return values, self.description_for_simulation(sim)
+
+    def description_for_simulation(self, sim):
+        """Return an instance of the class providing this property for the given simulation, if there is one"""
+        from .. import properties
         description_class = properties.providing_class(self._name, sim.output_handler_class, silent_fail=True)
         description = None
         if description_class is not None:
@@ -701,7 +709,7 @@ class StoredProperty(Calculation):
                 warnings.warn("%r occurred while trying to produce a property description from class %r"%
                               (e,description_class),
                               RuntimeWarning)
-        return values, description
+        return description
 
     def proxy_value(self):
         """Return a placeholder value for this calculation"""
@@ -0,0 +1,181 @@
+"""ORM-free evaluation of calculate_all for calculations on stored scalar properties.
+
+TimeStep.calculate_all normally loads a Halo object and its HaloProperty objects for every halo in the timestep,
+then evaluates the calculation tree one halo at a time. For the common case of a calculation built only from stored
+scalar properties, fixed numbers and elementwise arithmetic (e.g. ``calculate_all("Mvir/Rvir", "Vmax")``) this is
+unnecessary: all the required values can be retrieved in a single query, pivoted into numpy columns, and the
+arithmetic applied to whole columns at once.
+
+If any part of the calculation turns out not to be suitable (for example a property is stored as an array, or must be
+reassembled by its providing class), calculate_all returns None and the caller falls back to the general route."""
+
+from __future__ import absolute_import
+import numpy as np
+import sqlalchemy
+
+from .. import core
+from . import StoredProperty, FixedNumericInput, BuiltinFunction, MultiCalculation
+from ..core import extraction_patterns
+
+_ELEMENTWISE_FUNCTIONS = {'sqrt': np.sqrt, 'log': np.log, 'log10': np.log10,
+                          'subtract': np.subtract, 'add': np.add, 'divide': np.divide, 'multiply': np.multiply,
+                          'power': np.power,
+                          'greater': np.greater, 'less': np.less, 'equal': np.equal,
+                          'greater_equal': np.greater_equal, 'less_equal': np.less_equal,
+                          'logical_and': np.logical_and, 'logical_or': np.logical_or,
+                          'logical_not': np.logical_not}
+
+
+class _NotEligible(Exception):
+    pass
+
+
+def _collect_stored_properties(calculation, stored_properties):
+    if isinstance(calculation, StoredProperty):
+        if type(calculation._extraction_pattern) is not extraction_patterns.HaloPropertyValueGetter \
+                or calculation._multivalued:
+            raise _NotEligible()
+        stored_properties.setdefault(calculation.name(), calculation)
+    elif isinstance(calculation, FixedNumericInput):
+        pass
+    elif isinstance(calculation, MultiCalculation) and len(calculation.calculations)==1:
+        # bracketed sub-expression
+        _collect_stored_properties(calculation.calculations[0], stored_properties)
+    elif isinstance(calculation, BuiltinFunction) and calculation.name() in _ELEMENTWISE_FUNCTIONS:
+        for input in calculation._inputs:
+            _collect_stored_properties(input, stored_properties)
+    else:
+        raise _NotEligible()
+
+def _top_level_calculations(calculation):
+    if isinstance(calculation, MultiCalculation):
+        return calculation.calculations
+    else:
+        return [calculation]
+
+
+def _query_columns(session, timestep_id, name_ids, object_typecode, limit):
+    Halo = core.halo.Halo
+    props = core.halo_data.HaloProperty.__table__
+
+    halo_query = sqlalchemy.select([Halo.id]).where(Halo.timestep_id==timestep_id)
+    if object_typecode is not None:
+        halo_query = halo_query.where(Halo.object_typecode==object_typecode)
+    if limit:
+        halo_query = halo_query.limit(limit)
+    halo_ids = halo_query.alias()
+
+    # one row per (halo, property); halos with none of the properties still appear once, with a null name_id
+    query = sqlalchemy.select([halo_ids.c.id,
+                               sqlalchemy.func.coalesce(props.c.name_id, -1),
+                               props.c.data_float.isnot(None),
+                               sqlalchemy.func.coalesce(props.c.data_float, 0.0),
+                               props.c.data_int.isnot(None),
+                               sqlalchemy.func.coalesce(props.c.data_int, 0),
+                               props.c.data_array.isnot(None)]).\
+        select_from(halo_ids.outerjoin(props, (props.c.halo_id==halo_ids.c.id) & props.c.name_id.in_(name_ids))).\
+        order_by(halo_ids.c.id, props.c.id)
+
+    rows = session.execute(query).fetchall()
+    if len(rows)==0:
+        return [np.zeros(0)]*7
+    columns = list(zip(*rows))
+    dtypes = [np.int64, np.int64, bool, np.float64, bool, np.int64, bool]
+    return [np.array(c, dtype=d) for c, d in zip(columns, dtypes)]
+
+def _pivot(halo_id_per_row, name_id_per_row, float_present, float_value, int_present, int_value, array_present,
+           name_ids):
+    """Turn the rows of (halo, property) values into one column per property, taking the first match per halo"""
+    halo_ids = np.unique(halo_id_per_row)
+    columns = {}
+    for name_id in name_ids:
+        rows = np.where(name_id_per_row==name_id)[0]
+        _, first_in_halo = np.unique(halo_id_per_row[rows], return_index=True)
+        rows = rows[first_in_halo]
+        destination = np.searchsorted(halo_ids, halo_id_per_row[rows])
+
+        if array_present[rows].any():
+            raise _NotEligible()
+        if float_present[rows].all():
+            # includes the case where no halo has this property, in which case the dtype is irrelevant
+            values = np.zeros(len(halo_ids), dtype=np.float64)
+            values[destination] = float_value[rows]
+        elif int_present[rows].all():
+            values = np.zeros(len(halo_ids), dtype=np.int64)
+            values[destination] = int_value[rows]
+        else:
+            # mixture of types; leave it to the general route to decide what the output looks like
+            raise _NotEligible()
+
+        valid = np.zeros(len(halo_ids), dtype=bool)
+        valid[destination] = True
+        columns[name_id] = values, valid
+    return len(halo_ids), columns
+
+def _evaluate(calculation, columns, name_ids, n_halos):
+    """Return (values, valid) numpy arrays for the calculation"""
+    if isinstance(calculation, StoredProperty):
+        return columns[name_ids[calculation.name()]]
+    elif isinstance(calculation, FixedNumericInput):
+        return np.repeat(calculation.value, n_halos), np.ones(n_halos, dtype=bool)
+    elif isinstance(calculation, MultiCalculation):
+        return _evaluate(calculation.calculations[0], columns, name_ids, n_halos)
+    else:
+        inputs = [_evaluate(i, columns, name_ids, n_halos) for i in calculation._inputs]
+        valid = np.logical_and.reduce([v for _, v in inputs])
+        # as for the general route, arithmetic takes place on floats
+        with np.errstate(all='ignore'):
+            values = _ELEMENTWISE_FUNCTIONS[calculation.name()](*[np.asarray(x, dtype=float) for x, _ in inputs])
+        return values, valid
+
+def _requires_reassembly(name, handler_class):
+    from .. import properties
+    try:
+        providing_class = properties.providing_class(name, handler_class)
+    except NameError:
+        return False
+    return hasattr(providing_class, 'reassemble')
+
+def calculate_all(timestep, calculation, object_typecode=None, limit=None):
+    """Evaluate calculation for all halos in timestep, returning the same output as values_sanitized would.
+
+    Returns None if the calculation cannot be evaluated by this route."""
+    top_level = _top_level_calculations(calculation)
+    stored_properties = {}
+    try:
+        for c in top_level:
+            _collect_stored_properties(c, stored_properties)
+    except _NotEligible:
+        return None
+
+    session = core.Session()
+    try:
+        handler_class = timestep.simulation.output_handler_class
+        name_ids = {}
+        for name in stored_properties:
+            name_id = core.dictionary.get_dict_id(name, None, session=session)
+            if name_id is None or _requires_reassembly(name, handler_class):
+                return None
+            name_ids[name] = name_id
+
+        row_columns = _query_columns(session, timestep.id, list(name_ids.values()) or [-1], object_typecode, limit)
+    finally:
+        session.close()
+
+    try:
+        n_halos, columns = _pivot(*row_columns, name_ids=name_ids.values())
+    except _NotEligible:
+        return None
+
+    if n_halos==0:
+        return None
+
+    for stored_property in stored_properties.values():
+        # as in the general route, this warns the user if the description class is broken
+        stored_property.description_for_simulation(timestep.simulation)
+
+    results = [_evaluate(c, columns, name_ids, n_halos) for c in top_level]
+    keep = np.logical_and.reduce([valid for _, valid in results])
+    if not keep.any():
+        return [np.empty(0, dtype=object) for _ in results]
+    return [np.asarray(values)[keep] for values, _ in results]
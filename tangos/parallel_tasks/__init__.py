@@ -57,8 +57,11 @@ def launch(function, num_procs=None, args=[]):
 
     deinit_backend()
 
-def distributed(file_list, proc=None, of=None):
-    """Distribute a list of tasks between all nodes"""
+def distributed(file_list, proc=None, of=None, costs=None):
+    """Distribute a list of tasks between all nodes
+
+    :param costs: optionally, an estimate of the relative cost of each task (see jobs.parallel_iterate). Ignored
+                  when there is no parallel backend."""
 
     if type(file_list) == set:
         file_list = list(file_list)
@@ -75,7 +78,7 @@ def distributed(file_list, proc=None, of=None):
         return file_list[i:j + 1]
     else:
         from . import jobs
-        return jobs.parallel_iterate(file_list)
+        return jobs.parallel_iterate(file_list, costs)
 
 
 def _exec_function_or_server(function, args):
@@ -108,8 +111,10 @@ def _server_thread():
         if isinstance(obj, MessageExit):
             alive[obj.source]=False
         else:
-            obj.process()
+            with message.processing_mutex:
+                obj.process()
 
+    async_writer.stop_writer()
 
     log.logger.info("Terminating manager")
 
@@ -127,4 +132,4 @@ def _shutdown_parallelism():
 
 from .lock import ExclusiveLock
 from .barrier import barrier
-from . import remote_import
\ No newline at end of file
+from . import remote_import, async_writer
\ No newline at end of file
@@ -0,0 +1,175 @@
+"""Asynchronous writing of calculated properties to the database.
+
+Rather than each rank waiting for the insert_list lock and committing its own results, ranks can send their
+results to the manager (rank 0). There a background thread commits them while the ranks carry on calculating.
+
+If the writer falls behind by more than config.async_writer_max_queue_rows rows, ranks submitting further results
+are made to wait until the backlog has cleared."""
+
+from __future__ import absolute_import
+import collections
+import threading
+
+from .. import core, config
+from ..cached_writer import _id_of, insert_list, LinkTarget
+from . import message
+from ..log import logger
+
+_queue = collections.deque()
+_queue_condition = threading.Condition()
+_queue_rows = 0
+_batches_received = 0
+_batches_written = 0
+_stop_requested = False
+_writer_thread = None
+_writer_error = None
+_creator_id = None
+
+_ranks_awaiting_acceptance = []
+_ranks_awaiting_flush = [] # list of (rank, number of batches that must have been written)
+
+# statistics kept on the ranks submitting results, for reporting in the timing summary
+_last_reported_queue_rows = 0
+_max_reported_queue_rows = 0
+
+
+class MessageQueueProperties(message.Message):
+    def process(self):
+        global _queue_rows, _batches_received
+        _start_writer_if_needed()
+        with _queue_condition:
+            _queue.append(self.contents)
+            _queue_rows += len(self.contents)
+            _batches_received += 1
+            _queue_condition.notify()
+        _ranks_awaiting_acceptance.append(self.source)
+        _notify_waiting_ranks()
+
+class MessageQueueAccepted(message.Message):
+    pass
+
+class MessageFlushWriter(message.Message):
+    def process(self):
+        _ranks_awaiting_flush.append((self.source, _batches_received))
+        _notify_waiting_ranks()
+
+class MessageWriterFlushed(message.Message):
+    pass
+
+
+def _notify_waiting_ranks():
+    """Reply to any ranks that can now proceed. Must be called with message.processing_mutex held."""
+    global _ranks_awaiting_acceptance, _ranks_awaiting_flush
+    with _queue_condition:
+        queue_rows = _queue_rows
+        batches_written = _batches_written
+
+    if _writer_error is not None:
+        for rank in _ranks_awaiting_acceptance:
+            message.ExceptionMessage(_writer_error).send(rank)
+        for rank, _ in _ranks_awaiting_flush:
+            message.ExceptionMessage(_writer_error).send(rank)
+        _ranks_awaiting_acceptance = []
+        _ranks_awaiting_flush = []
+        return
+
+    if queue_rows<=config.async_writer_max_queue_rows:
+        for rank in _ranks_awaiting_acceptance:
+            MessageQueueAccepted(queue_rows).send(rank)
+        _ranks_awaiting_acceptance = []
+
+    still_waiting = []
+    for rank, batches_required in _ranks_awaiting_flush:
+        if batches_written>=batches_required:
+            MessageWriterFlushed().send(rank)
+        else:
+            still_waiting.append((rank, batches_required))
+    _ranks_awaiting_flush = still_waiting
+
+
+def _start_writer_if_needed():
+    global _writer_thread, _stop_requested, _creator_id
+    if _writer_thread is None:
+        _stop_requested = False
+        _creator_id = core.creator.get_creator_id()
+        _writer_thread = threading.Thread(target=_writer_loop)
+        _writer_thread.daemon = True
+        _writer_thread.start()
+
+def stop_writer():
+    """Finish writing any pending results and stop the writer thread, if it is running"""
+    global _writer_thread, _stop_requested
+    if _writer_thread is None:
+        return
+    with _queue_condition:
+        _stop_requested = True
+        _queue_condition.notify()
+    _writer_thread.join()
+    _writer_thread = None
+
+def _writer_loop():
+    global _queue_rows, _batches_written, _writer_error
+    session = core.Session()
+    try:
+        while True:
+            with _queue_condition:
+                while len(_queue)==0 and not _stop_requested:
+                    _queue_condition.wait()
+                if len(_queue)==0:
+                    break
+                batches = list(_queue)
+                _queue.clear()
+
+            rows = [row for batch in batches for row in batch]
+            if _writer_error is None:
+                try:
+                    insert_list(rows, session, _creator_id)
+                except Exception as e:
+                    logger.exception("Asynchronous writer failed to write %d rows", len(rows))
+                    session.rollback()
+                    _writer_error = e
+
+            with _queue_condition:
+                _queue_rows -= len(rows)
+                _batches_written += len(batches)
+
+            with message.processing_mutex:
+                _notify_waiting_ranks()
+    finally:
+        session.close()
+
+
+def _to_transferable(halo, name, value):
+    if isinstance(value, core.halo.Halo):
+        # the writer can insert the link using the id alone, without loading the halo
+        value = LinkTarget(_id_of(value))
+    return _id_of(halo), name, value
+
+def check_backend_supports_async_writing():
+    """Raise RuntimeError if the parallel backend cannot be used with the writer thread.
+
+    The writer thread replies to ranks while the manager's main thread is blocked receiving, which the backend must
+    permit (for MPI, this needs the MPI_THREAD_MULTIPLE level of thread support)."""
+    from . import backend
+    if not backend.supports_threads():
+        raise RuntimeError("The parallel backend does not allow messages to be sent and received from different "
+                           "threads, so asynchronous writing is not possible; run without --async-write")
+
+def queue_for_writing(property_list):
+    """Send (halo, name, value) tuples to the manager for writing; returns once the manager has accepted them.
+
+    The return may be delayed if the writer has a long backlog."""
+    global _last_reported_queue_rows, _max_reported_queue_rows
+    check_backend_supports_async_writing()
+    MessageQueueProperties([_to_transferable(*p) for p in property_list if p[2] is not None]).send(0)
+    _last_reported_queue_rows = MessageQueueAccepted.receive(0).contents
+    _max_reported_queue_rows = max(_max_reported_queue_rows, _last_reported_queue_rows)
+
+def flush():
+    """Wait until everything sent by this rank has been written to the database"""
+    MessageFlushWriter().send(0)
+    MessageWriterFlushed.receive(0)
+
+def summarise_queue(logger):
+    logger.info("ASYNCHRONOUS WRITER QUEUE DEPTH: %d rows at last submission; maximum %d rows",
+                _last_reported_queue_rows, _max_reported_queue_rows)
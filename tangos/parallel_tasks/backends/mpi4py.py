@@ -26,15 +26,22 @@ def receive(source=None, tag=0):
 def _get_dtype_code(numpy_dtype):
     return numpy_dtype.char
 
-def send_numpy_array(data, destination):
-    comm.send((data.shape, data.dtype), dest=destination, tag=1)
+def send_numpy_array(data, destination, send_metadata=True):
+    """Send a numpy array as a raw buffer.
+
+    If send_metadata is False, the shape and dtype are not sent; the receiver must then already know them and pass
+    them to receive_numpy_array."""
+    data = np.ascontiguousarray(data)
+    if send_metadata:
+        comm.send((data.shape, data.dtype), dest=destination, tag=1)
     # made necessary by strange bug with hdf arrays, similar to: https://groups.google.com/forum/#!topic/mpi4py/8gOVvT4ObvU
     # when sending without an explicit dtype code, sometimes get a KeyError
     dtype_code=_get_dtype_code(data.dtype)
     comm.Send([data, dtype_code], dest=destination, tag=2)
 
-def receive_numpy_array(source):
-    shape,dtype = comm.recv(source=source, tag=1)
+def receive_numpy_array(source, shape=None, dtype=None):
+    if shape is None:
+        shape,dtype = comm.recv(source=source, tag=1)
     ar = np.empty(shape,dtype=dtype)
     comm.Recv(ar,source=source,tag=2)
     return ar
@@ -48,6 +55,11 @@ def size():
 def barrier():
     comm.Barrier()
 
+def supports_threads():
+    """Return True if one thread may send while another is blocked receiving, which MPI allows only at the
+    MPI_THREAD_MULTIPLE level"""
+    return MPI.Query_thread()==MPI.THREAD_MULTIPLE
+
 def finalize():
     MPI.Finalize()
 
@@ -44,10 +44,11 @@ def receive(source=None, tag=0, return_tag=False):
 
 NUMPY_SPECIAL_TAG = 1515
 
-def send_numpy_array(data, destination):
+def send_numpy_array(data, destination, send_metadata=True):
+    # the array is pickled along with its shape and dtype, so send_metadata makes no difference
     send(data,destination,tag=NUMPY_SPECIAL_TAG)
 
-def receive_numpy_array(source):
+def receive_numpy_array(source, shape=None, dtype=None):
     return receive(source,tag=NUMPY_SPECIAL_TAG)
 
 def _pop_first_match_from_reception_buffer(source, tag):
@@ -81,6 +82,10 @@ def size():
 def barrier():
     pass
 
+def supports_threads():
+    # receiving is guarded by _recv_lock, and the pipe can be written while another thread waits on it
+    return True
+
 def finalize():
     _pipe.send("finalize")
 
@@ -131,7 +136,7 @@ def launch_functions(functions, args):
                 if message=='finalize':
                     #print "  ---> multiprocessing backend: finalize node ",i,running
                     running[i]=False
-                elif message[0]=='error':
+                elif isinstance(message[0], str) and message[0]=='error':
                     error = message[1]
                     running = [False]
                     break
@@ -20,6 +20,9 @@ def size():
 def barrier():
     pass
 
+def supports_threads():
+    return True
+
 def finalize():
     pass
 
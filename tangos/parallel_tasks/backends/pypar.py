@@ -29,6 +29,9 @@ def size():
 def barrier():
     pypar.barrier()
 
+def supports_threads():
+    return False
+
 def finalize():
     pypar.finalize()
 
@@ -38,12 +41,14 @@ class NumpyMetadataMessage(Message):
 class NumpyDataMessage(Message):
     pass
 
-def send_numpy_array(data, destination):
-    pypar.send((data.shape, data.dtype),destination=destination,tag=NumpyMetadataMessage._tag)
+def send_numpy_array(data, destination, send_metadata=True):
+    if send_metadata:
+        pypar.send((data.shape, data.dtype),destination=destination,tag=NumpyMetadataMessage._tag)
     pypar.send(data,destination=destination,tag=NumpyDataMessage._tag,use_buffer=True,bypass=True)
 
-def receive_numpy_array(source):
-    shape,dtype = pypar.receive(source=source, tag=NumpyMetadataMessage._tag)
+def receive_numpy_array(source, shape=None, dtype=None):
+    if shape is None:
+        shape,dtype = pypar.receive(source=source, tag=NumpyMetadataMessage._tag)
     ar = np.empty(shape,dtype=dtype)
     pypar.receive(source=source,buffer=ar,tag=NumpyDataMessage._tag)
     return ar
@@ -0,0 +1,215 @@
+"""A single-node backend in which processes communicate directly, passing large arrays through shared memory.
+
+Each rank has its own inbound queue, into which every other rank puts messages directly. Receiving blocks on the
+queue rather than polling. Numpy arrays above a threshold size are copied once into a shared memory segment by the
+sender; the receiver maps the same segment, so that the array it gets back shares memory with the segment rather
+than being unpickled into a fresh copy.
+
+Select with --backend shared_memory (requires python 3.8 or later)."""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import multiprocessing
+import os
+import signal
+import threading
+import weakref
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+from six.moves import queue, range
+
+_rank = None
+_size = None
+_queues = None
+_control_queue = None
+_recv_lock = None
+_recv_buffer = []
+_attached_segments = [] # (weak reference to array, SharedMemory) for segments mapped into this process
+
+_print_exceptions = True
+
+# arrays smaller than this number of bytes are pickled into the queue along with other messages
+SHARED_MEMORY_THRESHOLD = 65536
+
+NUMPY_SPECIAL_TAG = 1515
+
+
+class NoMatchingItem(Exception):
+    pass
+
+
+def send(data, destination, tag=0):
+    _queues[destination].put((data, _rank, tag))
+
+def receive_any(source=None):
+    return receive(source, None, True)
+
+def receive(source=None, tag=0, return_tag=False):
+    while True:
+        try:
+            item = _pop_first_match_from_reception_buffer(source, tag)
+            if return_tag:
+                return item
+            else:
+                return item[0]
+        except NoMatchingItem:
+            _receive_item_into_buffer()
+
+def _pop_first_match_from_reception_buffer(source, tag):
+    for item in _recv_buffer:
+        if ((item[2] == tag or tag is None) and (item[1] == source or source is None)):
+            # consume item
+            _recv_buffer.remove(item)
+            return item
+
+    raise NoMatchingItem()
+
+def _receive_item_into_buffer():
+    if _recv_lock.acquire(False):
+        try:
+            _recv_buffer.append(_queues[_rank].get())
+        finally:
+            _recv_lock.release()
+    else:
+        # block until a data item has been received by another thread
+        _recv_lock.acquire()
+        _recv_lock.release()
+
+
+def send_numpy_array(data, destination, send_metadata=True):
+    # the shape and dtype always travel with the message, so send_metadata makes no difference
+    data = np.ascontiguousarray(data)
+    if data.nbytes<SHARED_MEMORY_THRESHOLD:
+        send(("pickled", data), destination, tag=NUMPY_SPECIAL_TAG)
+        return
+
+    segment = shared_memory.SharedMemory(create=True, size=data.nbytes)
+    try:
+        np.ndarray(data.shape, dtype=data.dtype, buffer=segment.buf)[...] = data
+    finally:
+        segment.close()
+    # the receiver takes over responsibility for unlinking the segment
+    send(("shared", (segment.name, data.shape, data.dtype.str)), destination, tag=NUMPY_SPECIAL_TAG)
+
+def receive_numpy_array(source, shape=None, dtype=None):
+    method, contents = receive(source, tag=NUMPY_SPECIAL_TAG)
+    if method=="pickled":
+        return contents
+
+    _close_unused_segments()
+    name, shape, dtype = contents
+    segment = shared_memory.SharedMemory(name=name)
+    segment.unlink() # the memory remains available until it is unmapped by the close call
+    array = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+    _attached_segments.append((weakref.ref(array), segment))
+    return array
+
+def _close_unused_segments():
+    """Unmap the segments for which the received arrays (and any views of them) no longer exist"""
+    global _attached_segments
+    still_in_use = []
+    for array_ref, segment in _attached_segments:
+        if array_ref() is None:
+            try:
+                segment.close()
+            except BufferError:
+                # a view of the array was created in a way that does not keep the array itself alive
+                still_in_use.append((array_ref, segment))
+        else:
+            still_in_use.append((array_ref, segment))
+    _attached_segments = still_in_use
+
+
+def rank():
+    return _rank
+
+def size():
+    return _size
+
+def barrier():
+    pass
+
+def supports_threads():
+    return True
+
+def finalize():
+    _close_unused_segments()
+    _control_queue.put((_rank, "finalize"))
+
+
+def launch_wrapper(target_fn, rank_in, size_in, queues_in, control_queue_in, args_in):
+    global _rank, _size, _queues, _control_queue, _recv_lock
+    _rank = rank_in
+    _size = size_in
+    _queues = queues_in
+    _control_queue = control_queue_in
+    _recv_lock = threading.Lock()
+    try:
+        target_fn(*args_in)
+        finalize()
+    except Exception as e:
+        import sys, traceback
+        exc_type, exc_value, exc_traceback = sys.exc_info()
+        global _print_exceptions
+        if _print_exceptions:
+            print("Error on a sub-process:", file=sys.stderr)
+            traceback.print_exception(exc_type, exc_value, exc_traceback,
+                                      file=sys.stderr)
+        _control_queue.put((_rank, ("error", e)))
+
+
+def launch_functions(functions, args):
+    if _rank is not None:
+        raise RuntimeError("Multiprocessing session is already underway")
+
+    num_procs = len(functions)
+
+    # all processes must share one resource tracker, so that segments created by one process and unlinked by
+    # another are accounted for correctly
+    resource_tracker.ensure_running()
+
+    queues = [multiprocessing.Queue() for rank in range(num_procs)]
+    control_queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=launch_wrapper,
+                                         args=(function, rank, num_procs, queues, control_queue, args_i))
+                 for rank, (function, args_i) in enumerate(zip(functions, args))]
+
+    for proc_i in processes:
+        proc_i.start()
+
+    running = [True for rank in range(num_procs)]
+    error = False
+
+    while any(running):
+        try:
+            rank, message = control_queue.get(timeout=1.0)
+        except queue.Empty:
+            # check for processes that have died without reporting back
+            for i, proc_i in enumerate(processes):
+                if running[i] and not proc_i.is_alive():
+                    error = RuntimeError("Process %d terminated unexpectedly"%i)
+            if error:
+                break
+            continue
+
+        if message=='finalize':
+            running[rank] = False
+        elif message[0]=='error':
+            error = message[1]
+            break
+
+    for proc_i in processes:
+        if error and proc_i.is_alive():
+            os.kill(proc_i.pid, signal.SIGTERM)
+        proc_i.join()
+
+    if error:
+        raise error
+
+
+def launch(function, num_procs, args):
+    if num_procs is None:
+        raise RuntimeError("To launch a parallel session using shared_memory backend, you need to specify the number of processors")
+
+    launch_functions([function]*num_procs, [args]*num_procs)
@@ -1,21 +1,40 @@
 from __future__ import absolute_import
+from __future__ import division
+
+import numpy as np
+
 from . import message
-from .. import log
+from .. import log, config
 
 j = -1
 num_jobs = None
-current_job = None
+current_job = None  # position in job_order of the next job to hand out
+job_order = None  # the order in which jobs are handed out
+cumulative_cost = None  # the cumulative cost of the jobs, in the order they are handed out
+
+# jobs are taken to cost at least this fraction of the mean positive cost, so that jobs given zero cost are still
+# spread between the workers
+MINIMUM_RELATIVE_COST = 0.1
 
 class MessageStartIteration(message.Message):
     def process(self):
-        global num_jobs, current_job
+        global num_jobs, current_job, job_order, cumulative_cost
+        n_jobs, costs = self.contents
         if num_jobs is None:
-            num_jobs = self.contents
+            num_jobs = n_jobs
             current_job = 0
+            if costs is None:
+                job_order = np.arange(num_jobs)
+                cumulative_cost = np.arange(1, num_jobs+1, dtype=float)
+            else:
+                costs = _apply_minimum_cost(np.asarray(costs, dtype=float))
+                # most expensive first, so that the end of the loop is not held up by a large job
+                job_order = np.argsort(-costs, kind='mergesort')
+                cumulative_cost = np.cumsum(costs[job_order])
         else:
-            if num_jobs != self.contents:
+            if num_jobs != n_jobs:
                 raise RuntimeError("Number of jobs (%d) expected by rank %d is inconsistent with %d" % (
-                self.contents, self.source, num_jobs))
+                n_jobs, self.source, num_jobs))
 
 
 class MessageDeliverJob(message.Message):
@@ -23,38 +42,77 @@ class MessageDeliverJob(message.Message):
 
 class MessageRequestJob(message.Message):
     def process(self):
-        global j, num_jobs, current_job
+        global j, num_jobs, current_job, job_order, cumulative_cost
         source = self.source
         if current_job is not None and num_jobs>0:
-            log.logger.info("Send job %d of %d to node %d", current_job, num_jobs, source)
+            end_job = current_job + _next_chunk_size()
+            jobs = job_order[current_job:end_job].tolist()
+            if len(jobs)==1:
+                log.logger.info("Send job %d of %d to node %d", current_job, num_jobs, source)
+            else:
+                log.logger.info("Send jobs %d-%d of %d to node %d", current_job, current_job+len(jobs)-1,
+                                num_jobs, source)
         else:
             num_jobs = None
             current_job = None # in case num_jobs=0, still want to send 'end of loop' signal to client
+            jobs = None
             log.logger.info("Finished jobs; notify node %d", source)
 
-        MessageDeliverJob(current_job).send(source)
+        MessageDeliverJob(jobs).send(source)
 
         if current_job is not None:
-            current_job += 1
+            current_job += len(jobs)
             if current_job == num_jobs:
                 num_jobs = None
                 current_job = None
+                job_order = None
+                cumulative_cost = None
+
+
+def _apply_minimum_cost(costs):
+    positive_costs = costs[costs>0]
+    if len(positive_costs)==0:
+        return np.ones_like(costs)
+    return np.maximum(costs, positive_costs.mean()*MINIMUM_RELATIVE_COST)
+
+def _next_chunk_size():
+    """Return the number of jobs to hand out in response to the next request.
+
+    This implements guided self-scheduling: each chunk is a fixed fraction (1/config.parallel_job_chunk_factor) of
+    each worker's fair share of the remaining cost, so that chunks start large, keeping the number of round trips
+    low, and shrink towards the end of the loop, keeping the workers finishing at similar times."""
+    from . import backend
+    factor = config.parallel_job_chunk_factor
+    if not factor:
+        return 1
+    num_workers = max(backend.size()-1, 1)
+    cost_so_far = cumulative_cost[current_job-1] if current_job>0 else 0.0
+    target_cost = (cumulative_cost[-1]-cost_so_far)/(factor*num_workers)
+    num_within_target = np.searchsorted(cumulative_cost, cost_so_far+target_cost, side='right') - current_job
+    return max(int(num_within_target), 1)
+
 
+def parallel_iterate(task_list, costs=None):
+    """Sets up an iterator returning items of task_list.
 
-def parallel_iterate(task_list):
-    """Sets up an iterator returning items of task_list. """
+    :param costs: optionally, an estimate of the relative cost of each task. Tasks are then handed out in order of
+                  decreasing cost, and the chunks of tasks handed out to each rank are sized according to cost.
+                  No task is taken to cost less than MINIMUM_RELATIVE_COST times the mean positive cost."""
     from . import backend, barrier
 
     assert backend is not None, "Parallelism is not initialised"
-    MessageStartIteration(len(task_list)).send(0)
+    if costs is not None and len(costs)!=len(task_list):
+        raise ValueError("The number of costs must match the number of tasks")
+    MessageStartIteration((len(task_list), costs)).send(0)
     barrier()
 
     while True:
         MessageRequestJob().send(0)
-        job = MessageDeliverJob.receive(0).contents
+        jobs = MessageDeliverJob.receive(0).contents
 
-        if job is None:
+        if jobs is None:
             barrier()
             return
         else:
-            yield task_list[job]
\ No newline at end of file
+            for job in jobs:
+                yield task_list[job]
@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 from . import message, log, parallel_backend_loaded
 import time
+import threading
 import six
 from ..config import DEFAULT_SLEEP_BEFORE_ALLOWING_NEXT_LOCK
 
@@ -27,7 +28,7 @@ class MessageRequestLock(message.Message):
             _issue_next_lock(lock_id)
         elif _lock_in_shared_mode(lock_id) and self.shared:
             log.logger.debug("Issue shared lock %r to proc %d", lock_id, self.source)
-            MessageGrantLock((lock_id, False)).send(self.source)
+            _grant_lock(lock_id, self.source, False)
             _increment_lock_num_shared(lock_id,1)
 
 class MessageRelinquishLock(message.Message):
@@ -48,6 +49,15 @@ class MessageGrantLock(message.Message):
 
 _lock_queues = {}
 _lock_num_sharers = {}
+_local_grants = {} # lock_id -> (threading.Event, [impose_filesystem_delay]) for locks held by threads on the manager
+
+def _grant_lock(lock_id, proc, impose_filesystem_delay):
+    if proc==0:
+        event, delay = _local_grants[lock_id]
+        delay[0] = impose_filesystem_delay
+        event.set()
+    else:
+        MessageGrantLock((lock_id, impose_filesystem_delay)).send(proc)
 
 def _get_lock_queue(lock_id):
     lock_queue = _lock_queues.get(lock_id,[])
@@ -75,7 +85,7 @@ def _issue_next_lock(lock_id, impose_filesystem_delay=False):
             _issue_shared_locks(lock_id, impose_filesystem_delay)
         else:
             log.logger.debug("Issue lock %r to proc %d", lock_id, proc)
-            MessageGrantLock((lock_id, impose_filesystem_delay)).send(proc)
+            _grant_lock(lock_id, proc, impose_filesystem_delay)
 
 def _issue_shared_locks(lock_id, impose_filesystem_delay=False):
     queue = _get_lock_queue(lock_id)
@@ -83,7 +93,7 @@ def _issue_shared_locks(lock_id, impose_filesystem_delay=False):
     for proc, shared in queue:
         if shared:
             log.logger.debug("Issue shared lock %r to proc %d",lock_id, proc)
-            MessageGrantLock((lock_id, impose_filesystem_delay)).send(proc)
+            _grant_lock(lock_id, proc, impose_filesystem_delay)
             sharers_notified += 1
     _increment_lock_num_shared(lock_id,sharers_notified)
     log.logger.debug("Lock %r is currently in shared mode, with %d process(es) sharing it",
@@ -125,7 +135,9 @@ class ExclusiveLock(object):
     def acquire(self):
         if not parallel_backend_loaded():
             return
-        if self._count==0:
+        if self._count==0 and self._on_manager():
+            self._acquire_on_manager()
+        elif self._count==0:
             MessageRequestLock(self.name, self._shared).send(0)
             start = time.time()
             granted = MessageGrantLock.receive(0)
@@ -140,9 +152,37 @@ class ExclusiveLock(object):
         if not parallel_backend_loaded():
             return
         self._count-=1
-        if self._count==0:
+        if self._count==0 and self._on_manager():
+            self._release_on_manager()
+        elif self._count==0:
             MessageRelinquishLock(self.name).send(0)
 
+    @staticmethod
+    def _on_manager():
+        from . import backend
+        return backend is not None and backend.rank()==0
+
+    def _acquire_on_manager(self):
+        # A thread on the manager process (e.g. the asynchronous writer) cannot send itself messages; instead,
+        # it manipulates the lock queue directly and waits for the grant to be signalled
+        start = time.time()
+        with message.processing_mutex:
+            event, delay = _local_grants.setdefault(self.name, (threading.Event(), [False]))
+            event.clear()
+            request = MessageRequestLock(self.name, self._shared)
+            request.source = 0
+            request.process()
+        event.wait()
+        if delay[0]:
+            time.sleep(self._delay)
+        log.logger.debug("Lock %r acquired on manager in %.1fs", self.name, time.time() - start)
+
+    def _release_on_manager(self):
+        with message.processing_mutex:
+            relinquish = MessageRelinquishLock(self.name)
+            relinquish.source = 0
+            relinquish.process()
+
     def __enter__(self):
         self.acquire()
 
@@ -3,6 +3,11 @@ import contextlib
 import six
 import struct
 import hashlib
+import threading
+
+# Held by the manager process while it processes a message. Any other thread on the manager that wants to
+# update the manager's state or send messages must also hold it.
+processing_mutex = threading.RLock()
 
 
 def _stable_hash(string):
@@ -1,9 +1,12 @@
 from __future__ import absolute_import
 from .message import Message, ExceptionMessage
-from . import log, parallel_backend_loaded, remote_import
+from . import log, parallel_backend_loaded, remote_import, message
+from .. import config
 from ..util.check_deleted import check_deleted
 import pynbody
 import gc
+import collections
+import threading
 import six.moves.cPickle as pickle
 import numpy as np
 from six.moves import zip
@@ -28,57 +31,92 @@ class ObjectSpecification(object):
     def __hash__(self):
         return hash((self.object_number, self.object_typetag))
 
+def _snapshot_nbytes(snap):
+    """Return the number of bytes held by the arrays that have so far been realised in snap"""
+    nbytes = sum(array.nbytes for array in snap._arrays.values())
+    for family_arrays in snap._family_arrays.values():
+        nbytes += sum(array.nbytes for array in family_arrays.values())
+    return nbytes
+
+class _ResidentSnapshot(object):
+    """A snapshot held by the server (or being loaded), together with the clients using it"""
+    def __init__(self, handler, filename):
+        self.handler = handler
+        self.filename = filename
+        self.snapshot = None
+        self.subsnap_cache = {}
+        self.users = []
+        self.awaiting_load = []
+
+    @property
+    def loaded(self):
+        return self.snapshot is not None
+
 class PynbodySnapshotQueue(object):
+    """Loads snapshots on behalf of clients, keeping several in memory at once where configured.
+
+    Up to config.pynbody_server_max_snapshots snapshots are held, subject to config.pynbody_server_memory_budget.
+    A snapshot that no client is using stays in memory in case it is requested again, until the room is needed;
+    the least recently used is then freed first. Where the parallel backend allows, snapshots are loaded on a
+    background thread, so that a client waiting for the next timestep does not hold up those using the current one."""
     def __init__(self):
-        self.timestep_queue = []
-        self.handler_queue = []
-        self.load_requester_queue = []
-        self.current_timestep = None
-        self.current_snapshot = None
-        self.current_subsnap_cache = {}
-        self.current_handler = None
-        self.in_use_by = []
+        self.load_queue = []
+        self.resident = collections.OrderedDict() # filename -> _ResidentSnapshot, least recently used first
+        self.timestep_for_client = {}
+        self.loading = None
 
     def add(self, handler, filename, requester):
         log.logger.debug("Pynbody server: client %d requests access to %r", requester, filename)
-        if filename==self.current_timestep:
-            self._notify_available(requester)
-            self.in_use_by.append(requester)
-        elif filename in self.timestep_queue:
-            queue_position = self.timestep_queue.index(filename)
-            self.load_requester_queue[queue_position].append(requester)
-            assert self.handler_queue[queue_position] == handler
+        self.timestep_for_client[requester] = filename
+        if filename in self.resident:
+            entry = self.resident.pop(filename)
+            self.resident[filename] = entry # now the most recently used
+            assert entry.handler == handler
+            if entry.loaded:
+                entry.users.append(requester)
+                self._notify_available(entry, requester)
+            else:
+                entry.awaiting_load.append(requester)
         else:
-            self.timestep_queue.append(filename)
-            self.handler_queue.append(handler)
-            self.load_requester_queue.append([requester])
-        self._load_next_if_free()
+            queued = [entry for entry in self.load_queue if entry.filename==filename]
+            if len(queued)>0:
+                entry = queued[0]
+                assert entry.handler == handler
+            else:
+                entry = _ResidentSnapshot(handler, filename)
+                self.load_queue.append(entry)
+            entry.awaiting_load.append(requester)
+        self._load_next_if_possible()
 
     def free(self, requester):
-        self.in_use_by.remove(requester)
-        log.logger.debug("Pynbody server: client %d is now finished with %r", requester, self.current_timestep)
-        self._free_if_unused()
-        self._load_next_if_free()
+        filename = self.timestep_for_client.pop(requester)
+        self.resident[filename].users.remove(requester)
+        log.logger.debug("Pynbody server: client %d is now finished with %r", requester, filename)
+        self._load_next_if_possible()
+
+    def timestep_for(self, client):
+        return self.timestep_for_client[client]
 
-    def get_subsnap(self, filter_or_object_spec, fam):
-        if (filter_or_object_spec, fam) in self.current_subsnap_cache:
+    def get_subsnap(self, filename, filter_or_object_spec, fam):
+        entry = self.resident[filename]
+        if (filter_or_object_spec, fam) in entry.subsnap_cache:
             log.logger.debug("Pynbody server: cache hit for %r (fam %r)",filter_or_object_spec, fam)
-            return self.current_subsnap_cache[(filter_or_object_spec, fam)]
+            return entry.subsnap_cache[(filter_or_object_spec, fam)]
         else:
             log.logger.debug("Pynbody server: cache miss for %r (fam %r)",filter_or_object_spec, fam)
-            subsnap = self.get_subsnap_uncached(filter_or_object_spec, fam)
-            self.current_subsnap_cache[(filter_or_object_spec, fam)] = subsnap
+            subsnap = self.get_subsnap_uncached(entry, filter_or_object_spec, fam)
+            entry.subsnap_cache[(filter_or_object_spec, fam)] = subsnap
             return subsnap
 
-    def get_subsnap_uncached(self, filter_or_object_spec, fam):
+    def get_subsnap_uncached(self, entry, filter_or_object_spec, fam):
 
-        snap = self.current_snapshot
+        snap = entry.snapshot
 
         if isinstance(filter_or_object_spec, pynbody.filt.Filter):
             snap = snap[filter_or_object_spec]
         elif isinstance(filter_or_object_spec, ObjectSpecification):
-            snap = self.current_handler.load_object(self.current_timestep, filter_or_object_spec.object_number,
-                                                    filter_or_object_spec.object_typetag)
+            snap = entry.handler.load_object(entry.filename, filter_or_object_spec.object_number,
+                                             filter_or_object_spec.object_typetag)
         else:
             raise TypeError("filter_or_object_spec must be either a pynbody filter or an ObjectRequestInformation object")
 
@@ -87,41 +125,81 @@ class PynbodySnapshotQueue(object):
 
         return snap
 
+    def resident_nbytes(self):
+        return sum(_snapshot_nbytes(entry.snapshot) for entry in self.resident.values() if entry.loaded)
 
-
-    def _free_if_unused(self):
-        if len(self.in_use_by)==0:
-            log.logger.debug("Pynbody server: all clients are finished with the current snapshot; freeing.")
-            with check_deleted(self.current_snapshot):
-                self.current_snapshot = None
-                self.current_timestep = None
-                self.current_subsnap_cache = {}
-                self.current_handler = None
-
-    def _notify_available(self, node):
+    def _has_room(self):
+        if len(self.resident)==0:
+            return True
+        if len(self.resident)>=config.pynbody_server_max_snapshots:
+            return False
+        budget = config.pynbody_server_memory_budget
+        return budget is None or self.resident_nbytes()<budget
+
+    def _free_least_recently_used(self):
+        """Free the least recently used snapshot that no client is using. Returns False if there is none."""
+        for filename, entry in self.resident.items():
+            if entry.loaded and len(entry.users)==0:
+                log.logger.debug("Pynbody server: freeing %r, which is no longer in use", filename)
+                del self.resident[filename]
+                with check_deleted(entry.snapshot):
+                    entry.snapshot = None
+                    entry.subsnap_cache = {}
+                return True
+        return False
+
+    def _notify_available(self, entry, node):
         log.logger.debug("Pynbody server: notify %d that snapshot is now available", node)
-        ConfirmLoadPynbodySnapshot(type(self.current_snapshot)).send(node)
+        ConfirmLoadPynbodySnapshot(type(entry.snapshot)).send(node)
 
-    def _load_next_if_free(self):
-        if len(self.timestep_queue)==0:
+    def _load_next_if_possible(self):
+        """Start loading the next queued snapshot, if there is room for it. Must be called with
+        message.processing_mutex held."""
+        if len(self.load_queue)==0 or self.loading is not None:
             return
 
-        if self.current_handler is None:
-            # TODO: Error handling
-            self.current_timestep = self.timestep_queue.pop(0)
-            self.current_handler = self.handler_queue.pop(0)
+        while not self._has_room():
+            if not self._free_least_recently_used():
+                log.logger.info("The loaded snapshots are still required and so other clients will have to wait")
+                log.logger.info("(Currently %d snapshots are in the queue to be loaded later)", len(self.load_queue))
+                return
 
-            self.current_snapshot = self.current_handler.load_timestep(self.current_timestep)
-            self.current_snapshot.physical_units()
-            log.logger.info("Pynbody server: loaded %r", self.current_timestep)
+        self.loading = self.load_queue.pop(0)
+        self.resident[self.loading.filename] = self.loading
 
-            notify = self.load_requester_queue.pop(0)
-            self.in_use_by = notify
-            for n in notify:
-                self._notify_available(n)
+        from . import backend
+        if backend.supports_threads():
+            loader = threading.Thread(target=self._load, args=(self.loading,))
+            loader.daemon = True
+            loader.start()
         else:
-            log.logger.info("The currently loaded snapshot is still required and so other clients will have to wait")
-            log.logger.info("(Currently %d snapshots are in the queue to be loaded later)", len(self.timestep_queue))
+            self._load(self.loading)
+
+    def _load(self, entry):
+        try:
+            snapshot = entry.handler.load_timestep(entry.filename)
+            snapshot.physical_units()
+            exception = None
+        except Exception as e:
+            snapshot = None
+            exception = e
+
+        with message.processing_mutex:
+            self.loading = None
+            if exception is None:
+                log.logger.info("Pynbody server: loaded %r", entry.filename)
+                entry.snapshot = snapshot
+                entry.users = entry.awaiting_load
+                for n in entry.awaiting_load:
+                    self._notify_available(entry, n)
+            else:
+                log.logger.error("Pynbody server: failed to load %r", entry.filename)
+                del self.resident[entry.filename]
+                for n in entry.awaiting_load:
+                    del self.timestep_for_client[n]
+                    ExceptionMessage(exception).send(n)
+            entry.awaiting_load = []
+            self._load_next_if_possible()
 
 
 
@@ -139,11 +217,12 @@ class ReturnPynbodyArray(Message):
     @classmethod
     def deserialize(cls, source, message):
         from . import backend
-        contents = backend.receive_numpy_array(source=source)
+        units, shape, dtype = message
+        contents = backend.receive_numpy_array(source=source, shape=shape, dtype=dtype)
 
-        if message!="":
+        if units!="":
             contents = contents.view(pynbody.array.SimArray)
-            contents.units = pickle.loads(message)
+            contents.units = pickle.loads(units)
 
         obj = ReturnPynbodyArray(contents)
         obj.source = source
@@ -153,11 +232,12 @@ class ReturnPynbodyArray(Message):
     def serialize(self):
         assert isinstance(self.contents, np.ndarray)
         if hasattr(self.contents, 'units'):
-            serialized_info = pickle.dumps(self.contents.units)
+            serialized_units = pickle.dumps(self.contents.units)
         else:
-            serialized_info = ""
+            serialized_units = ""
 
-        return serialized_info
+        # the shape and dtype travel in the envelope, so that the backend need only send the raw buffer
+        return serialized_units, self.contents.shape, self.contents.dtype.str
 
     def send(self, destination):
         # send envelope
@@ -165,7 +245,46 @@ class ReturnPynbodyArray(Message):
 
         # send contents
         from . import backend
-        backend.send_numpy_array(self.contents.view(np.ndarray), destination)
+        backend.send_numpy_array(np.ascontiguousarray(self.contents.view(np.ndarray)), destination,
+                                 send_metadata=False)
+
+
+def _get_array_for_transfer(subsnap, array_name):
+    with subsnap.immediate_mode, subsnap.lazy_derive_off:
+        if subsnap._array_name_implies_ND_slice(array_name):
+            raise KeyError("Not transferring a single slice %r of a ND array"%array_name)
+        if array_name=='remote-index-list':
+            return subsnap.get_index_list(subsnap.ancestor)
+        else:
+            subarray = subsnap[array_name]
+            assert isinstance(subarray, pynbody.array.SimArray)
+            return subarray
+
+def _send_arrays(destination, filter_or_object_spec, array_names, fam):
+    """Send a ReturnPynbodyArray (or an ExceptionMessage if the array is not available) for each named array"""
+    start_time = time.time()
+    log.logger.debug("Receive request for arrays %r from %d", array_names, destination)
+    try:
+        subsnap = _server_queue.get_subsnap(_server_queue.timestep_for(destination), filter_or_object_spec, fam)
+        subsnap_exception = None
+    except Exception as e:
+        subsnap = None
+        subsnap_exception = e
+
+    for array_name in array_names:
+        try:
+            if subsnap_exception is not None:
+                raise subsnap_exception
+            array_result = ReturnPynbodyArray(_get_array_for_transfer(subsnap, array_name))
+        except Exception as e:
+            array_result = ExceptionMessage(e)
+
+        array_result.send(destination)
+        del array_result
+
+    # collect once per request rather than once per array; arrays already sent are then freed together
+    gc.collect()
+    log.logger.debug("%d array(s) sent after %.2fs", len(array_names), time.time()-start_time)
 
 class RequestPynbodyArray(Message):
     def __init__(self, filter_or_object_spec, array, fam=None):
@@ -183,28 +302,28 @@ class RequestPynbodyArray(Message):
         return (self.filter_or_object_spec, self.array, self.fam)
 
     def process(self):
-        start_time = time.time()
-        try:
-            log.logger.debug("Receive request for array %r from %d",self.array,self.source)
-            subsnap = _server_queue.get_subsnap(self.filter_or_object_spec, self.fam)
-
-            with subsnap.immediate_mode, subsnap.lazy_derive_off:
-                if subsnap._array_name_implies_ND_slice(self.array):
-                    raise KeyError("Not transferring a single slice %r of a ND array"%self.array)
-                if self.array=='remote-index-list':
-                    subarray = subsnap.get_index_list(subsnap.ancestor)
-                else:
-                    subarray = subsnap[self.array]
-                    assert isinstance(subarray, pynbody.array.SimArray)            
-                array_result = ReturnPynbodyArray(subarray)
+        _send_arrays(self.source, self.filter_or_object_spec, [self.array], self.fam)
 
-        except Exception as e:
-            array_result = ExceptionMessage(e)
-        
-        array_result.send(self.source)
-        del array_result
-        gc.collect()
-        log.logger.debug("Array sent after %.2fs"%(time.time()-start_time))
+class RequestPynbodyArrays(Message):
+    """Request several arrays from the same subsnap in one message.
+
+    The server replies with one ReturnPynbodyArray (or ExceptionMessage) per array, in the order requested."""
+    def __init__(self, filter_or_object_spec, arrays, fam=None):
+        self.filter_or_object_spec = filter_or_object_spec
+        self.arrays = arrays
+        self.fam = fam
+
+    @classmethod
+    def deserialize(cls, source, message):
+        obj = RequestPynbodyArrays(*message)
+        obj.source = source
+        return obj
+
+    def serialize(self):
+        return (self.filter_or_object_spec, self.arrays, self.fam)
+
+    def process(self):
+        _send_arrays(self.source, self.filter_or_object_spec, self.arrays, self.fam)
 
 
 
@@ -245,9 +364,9 @@ class RequestPynbodySubsnapInfo(Message):
 
     def process(self):
         start_time = time.time()
-        assert(_server_queue.current_timestep == self.filename)
+        assert(_server_queue.timestep_for(self.source) == self.filename)
         log.logger.debug("Received request for subsnap info, spec %r", self.filter_or_object_spec)
-        obj = _server_queue.get_subsnap(self.filter_or_object_spec, None)
+        obj = _server_queue.get_subsnap(self.filename, self.filter_or_object_spec, None)
         families = obj.families()
         fam_lengths = [len(obj[fam]) for fam in families]
         fam_lkeys = [obj.loadable_keys(fam) for fam in families]
@@ -287,18 +406,36 @@ class RemoteSubSnap(pynbody.snapshot.SimSnap):
 
 
     def _load_array(self, array_name, fam=None):
-        RequestPynbodyArray(self._filter_or_object_spec, array_name, fam).send(self._server_id)
-        try:
-            start_time=time.time()
-            log.logger.debug("Send array request")
-            data = ReturnPynbodyArray.receive(self._server_id).contents
-            log.logger.debug("Array received; waited %.2fs",time.time()-start_time)
-        except KeyError:
-            raise IOError("No such array %r available from the remote"%array_name)
-        if fam is None:
-            self[array_name] = data
-        else:
-            self[fam][array_name] = data
+        self.load_arrays([array_name], fam)
+
+    def load_arrays(self, array_names, fam=None):
+        """Fetch the named arrays from the server in a single round trip, skipping any that are already present
+
+        If any array is not available from the server, the others are still loaded before IOError is raised."""
+        target = self if fam is None else self[fam]
+        array_names = [name for name in array_names if name not in target.keys()]
+        if len(array_names)==0:
+            return
+
+        RequestPynbodyArrays(self._filter_or_object_spec, array_names, fam).send(self._server_id)
+        start_time=time.time()
+        log.logger.debug("Send request for %d array(s)", len(array_names))
+
+        first_exception = None
+        for array_name in array_names:
+            # every reply must be received, even after a failure, to keep in step with the server
+            try:
+                target[array_name] = ReturnPynbodyArray.receive(self._server_id).contents
+            except KeyError:
+                if first_exception is None:
+                    first_exception = IOError("No such array %r available from the remote"%array_name)
+            except Exception as e:
+                if first_exception is None:
+                    first_exception = e
+
+        log.logger.debug("Arrays received; waited %.2fs",time.time()-start_time)
+        if first_exception is not None:
+            raise first_exception
 
 
 _connection_active = False
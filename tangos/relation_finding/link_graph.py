@@ -0,0 +1,146 @@
+"""An in-memory index of the links between halos, allowing relations to be found without a query per hop.
+
+A LinkGraph holds the halolink rows originating in one simulation in compressed sparse row (CSR) form: each halo
+involved is assigned a node index, and the links from node i are entries offsets[i]:offsets[i+1] of the link_*
+arrays. Graphs are built on first use and rebuilt when links from the simulation have been added or removed.
+
+MultiHopStrategy and its variants use the graph in place of SQL when config.use_link_graph is True (see
+MultiHopStrategy._make_hops_with_link_graph)."""
+
+from __future__ import absolute_import
+import weakref
+
+import numpy as np
+import sqlalchemy
+
+from .. import core
+
+_graphs = weakref.WeakKeyDictionary() # maps engine -> {simulation id -> LinkGraph}
+
+
+class LinkGraph(object):
+    def __init__(self, session, simulation_id, signature=None):
+        """Load all links from halos in the specified simulation.
+
+        :param signature: a value identifying the state of the links from the simulation (see
+                          core.main_branch.get_link_signature), used to spot when the graph is out of date"""
+        self.simulation_id = simulation_id
+        self.signature = signature
+
+        halo_ids, timestep_ids, halo_numbers, times, simulation_ids = self._query_halos(session, simulation_id)
+        link_from_ids, link_to_ids, link_weights, link_relation_ids, to_halo_metadata = \
+            self._query_links(session, simulation_id)
+
+        # nodes are all halos in this simulation, plus any halos in other simulations that links point to
+        all_metadata = [np.concatenate((a, b)) for a, b in
+                        zip((halo_ids, timestep_ids, halo_numbers, times, simulation_ids), to_halo_metadata)]
+        self.node_halo_id, unique_index = np.unique(all_metadata[0], return_index=True)
+        self.node_timestep_id, self.node_halo_number, self.node_time, self.node_simulation_id = \
+            [a[unique_index] for a in all_metadata[1:]]
+
+        link_from = np.searchsorted(self.node_halo_id, link_from_ids)
+        self.link_to = np.searchsorted(self.node_halo_id, link_to_ids)
+        self.link_weight = link_weights
+        self.link_relation_id = link_relation_ids
+        counts = np.bincount(link_from, minlength=len(self.node_halo_id))
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+
+        self._setup_reverse_lookup(link_from)
+
+    @staticmethod
+    def _query_halos(session, simulation_id):
+        halos = core.halo.Halo.__table__
+        timesteps = core.timestep.TimeStep.__table__
+        query = sqlalchemy.select([halos.c.id, halos.c.timestep_id, halos.c.halo_number, timesteps.c.time_gyr,
+                                   timesteps.c.simulation_id]). \
+            select_from(halos.join(timesteps, halos.c.timestep_id == timesteps.c.id)). \
+            where(timesteps.c.simulation_id == simulation_id)
+        return _columns_to_arrays(session.execute(query).fetchall(),
+                                  [np.int64, np.int64, np.int64, np.float64, np.int64])
+
+    @staticmethod
+    def _query_links(session, simulation_id):
+        links = core.halo_data.HaloLink.__table__
+        halo_from = core.halo.Halo.__table__.alias()
+        halo_to = core.halo.Halo.__table__.alias()
+        timestep_from = core.timestep.TimeStep.__table__.alias()
+        timestep_to = core.timestep.TimeStep.__table__.alias()
+        query = sqlalchemy.select([links.c.halo_from_id, links.c.halo_to_id, links.c.weight,
+                                   sqlalchemy.func.coalesce(links.c.relation_id, -1),
+                                   halo_to.c.timestep_id, halo_to.c.halo_number, timestep_to.c.time_gyr,
+                                   timestep_to.c.simulation_id]). \
+            select_from(links.join(halo_from, links.c.halo_from_id == halo_from.c.id).
+                        join(timestep_from, halo_from.c.timestep_id == timestep_from.c.id).
+                        join(halo_to, links.c.halo_to_id == halo_to.c.id).
+                        join(timestep_to, halo_to.c.timestep_id == timestep_to.c.id)). \
+            where(timestep_from.c.simulation_id == simulation_id). \
+            order_by(links.c.halo_from_id, links.c.id)
+        columns = _columns_to_arrays(session.execute(query).fetchall(),
+                                     [np.int64, np.int64, np.float64, np.int64,
+                                      np.int64, np.int64, np.float64, np.int64])
+        to_halo_metadata = [columns[1]] + columns[4:]
+        return columns[0], columns[1], columns[2], columns[3], to_halo_metadata
+
+    def _setup_reverse_lookup(self, link_from):
+        # sorted (from, to) pair keys, with the maximum weight of any link between each pair
+        n_nodes = len(self.node_halo_id)
+        keys = link_from*n_nodes + self.link_to
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        weights = self.link_weight[order]
+        if len(keys)>0:
+            starts = np.concatenate(([0], np.where(np.diff(keys)!=0)[0]+1))
+            self._pair_keys = keys[starts]
+            self._pair_max_weights = np.maximum.reduceat(weights, starts)
+        else:
+            self._pair_keys = keys
+            self._pair_max_weights = weights
+
+    def node_index(self, halo_ids):
+        """Return the node index for each halo id, or -1 for halos with no node"""
+        halo_ids = np.asarray(halo_ids, dtype=np.int64)
+        index = np.searchsorted(self.node_halo_id, halo_ids)
+        index_clipped = np.minimum(index, len(self.node_halo_id)-1)
+        found = (index<len(self.node_halo_id))
+        if len(self.node_halo_id)>0:
+            found &= self.node_halo_id[index_clipped]==halo_ids
+        return np.where(found, index, -1)
+
+    def links_from(self, nodes):
+        """Return (position, link) arrays listing every link from the given nodes.
+
+        position gives the offset into the nodes array that each link comes from; link indexes the link_* arrays."""
+        nodes = np.asarray(nodes)
+        has_node = nodes>=0
+        starts = np.where(has_node, self.offsets[np.maximum(nodes, 0)], 0)
+        counts = np.where(has_node, self.offsets[np.maximum(nodes, 0)+1]-starts, 0)
+        position = np.repeat(np.arange(len(nodes)), counts)
+        first_of_position = np.repeat(np.cumsum(counts)-counts, counts)
+        link = np.repeat(starts, counts) + np.arange(len(position)) - first_of_position
+        return position, link
+
+    def reverse_link_weight(self, from_nodes, to_nodes):
+        """For each pair of nodes, return the largest weight of a link from to_node back to from_node (or -inf)"""
+        keys = np.asarray(to_nodes)*len(self.node_halo_id) + np.asarray(from_nodes)
+        index = np.searchsorted(self._pair_keys, keys)
+        index_clipped = np.minimum(index, len(self._pair_keys)-1)
+        if len(self._pair_keys)==0:
+            return np.repeat(-np.inf, len(keys))
+        found = (index<len(self._pair_keys)) & (self._pair_keys[index_clipped]==keys)
+        return np.where(found, self._pair_max_weights[index_clipped], -np.inf)
+
+
+def _columns_to_arrays(rows, dtypes):
+    if len(rows)==0:
+        return [np.zeros(0, dtype=d) for d in dtypes]
+    return [np.array(c, dtype=d) for c, d in zip(zip(*rows), dtypes)]
+
+def get_link_graph(session, simulation_id):
+    """Return the LinkGraph for the specified simulation, building it if necessary"""
+    signature = core.main_branch.get_link_signature(session, simulation_id)
+    graphs = _graphs.setdefault(session.get_bind(), {})
+    graph = graphs.get(simulation_id, None)
+    if graph is None or graph.signature!=signature:
+        graph = LinkGraph(session, simulation_id, signature)
+        graphs[simulation_id] = graph
+    return graph
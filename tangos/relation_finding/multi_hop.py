@@ -1,9 +1,11 @@
 from __future__ import absolute_import
+import collections
 import contextlib
 import random
 import string
 import sys
 
+import numpy as np
 import sqlalchemy
 import sqlalchemy.exc
 import sqlalchemy.orm
@@ -12,17 +14,55 @@ import sqlalchemy.orm.query
 from sqlalchemy import and_, Table, Index, Column, Integer, Float, ForeignKey
 from sqlalchemy.orm import relationship
 
-from .. import core
+from .. import core, config
 from .. import temporary_halolist
 from .one_hop import HopStrategy
+from . import link_graph
 
 from ..config import num_multihops_max_default as NHOPS_MAX_DEFAULT
 from ..config import max_relative_time_difference as SMALL_FRACTION
 from six.moves import range
 
+_RecursiveCandidateLinks = collections.namedtuple("_RecursiveCandidateLinks",
+                                                  ["from_clause", "condition", "link", "halo_new", "timestep_new"])
+
+class _GraphHops(object):
+    """A set of hops between nodes of a LinkGraph, stored as parallel arrays"""
+    def __init__(self, from_node, to_node, weight, source):
+        self.from_node = from_node
+        self.to_node = to_node
+        self.weight = weight
+        self.source = source
+
+    def __len__(self):
+        return len(self.to_node)
+
+    def take(self, index):
+        return _GraphHops(self.from_node[index], self.to_node[index], self.weight[index], self.source[index])
+
 class MultiHopStrategy(HopStrategy):
     """An extension of the HopStrategy class that takes multiple hops across
-    HaloLinks, up to a specified maximum, before finding the target halo."""
+    HaloLinks, up to a specified maximum, before finding the target halo.
+
+    Three engines are available. The hop-by-hop engine issues a few statements per hop, staging each new level of
+    links in a temporary table. Where the database supports it and a single link is followed forwards or backwards
+    in time from each halo (as for major progenitors and descendants), the recursive engine instead performs the
+    whole traversal in a single WITH RECURSIVE statement. If config.use_link_graph is True, hops within a
+    simulation are instead followed in memory using a LinkGraph.
+    All three populate the same table of results, as does MultiHopMajorProgenitorsStrategy when it is able to read
+    the branch from the precomputed main branch index (see core.main_branch)."""
+
+    # A subclass that overrides any of these steps of the hop-by-hop engine must also reproduce its behaviour for
+    # the other engines (see _recursive_link_filter, _link_graph_filter etc) and then declare
+    # _recursive_query_compatible = True and/or _link_graph_compatible = True; otherwise it is always run with the
+    # hop-by-hop engine. Similarly _main_branch_index_compatible = True declares that an override does not
+    # change which halos are on the major progenitor branch.
+    _hop_by_hop_steps = ['_make_hops', '_hopping_finished', '_seed_temp_table', '_generate_next_level_prelim_links',
+                         '_filter_prelim_links_into_final', '_supplement_halolink_query_with_filter',
+                         '_supplement_halolink_query_with_reverse_hop_filter', '_should_halt']
+    _recursive_query_compatible = True
+    _link_graph_compatible = True
+    _main_branch_index_compatible = True
 
     halo_old = sqlalchemy.orm.aliased(core.halo.Halo, name="halo_old")
     halo_new = sqlalchemy.orm.aliased(core.halo.Halo, name="halo_new")
@@ -108,9 +148,19 @@ class MultiHopStrategy(HopStrategy):
 
     def _generate_multihop_results(self):
         self._generate_query()
-        self._seed_temp_table()
-        self._filter_query_for_target(self._target)
-        self._make_hops()
+        if self._main_branch_index_available():
+            self._filter_query_for_target(self._target)
+            self._make_hops_with_main_branch_index()
+        elif self._link_graph_available():
+            self._filter_query_for_target(self._target)
+            self._make_hops_with_link_graph()
+        elif self._recursive_query_available():
+            self._filter_query_for_target(self._target)
+            self._make_hops_with_recursive_query()
+        else:
+            self._seed_temp_table()
+            self._filter_query_for_target(self._target)
+            self._make_hops()
 
     def _execute_query(self):
         with self._manage_temp_table():
@@ -303,6 +353,199 @@ class MultiHopStrategy(HopStrategy):
 
         return query
 
+    def _recursive_query_available(self):
+        if not config.multihop_recursive_query:
+            return False
+
+        # 'across' hops depend on which timesteps have already been reached, which a recursive query cannot
+        # express
+        if self.directed is None or self.directed.lower() not in ('backwards', 'forwards'):
+            return False
+
+        # The hop-by-hop engine keeps only the strongest route to each halo at each level, but a recursive query
+        # cannot combine routes until it has finished, so where links fan out and rejoin the number of routes
+        # grows exponentially with the number of hops. The recursive engine is therefore only used where a
+        # single link is followed from each halo.
+        if self._recursive_link_choice_order(self._recursive_candidate_links(self._recursive_seed())) is None:
+            return False
+
+        dialect = self._connection.dialect
+        if dialect.name=='sqlite':
+            # window functions, used to combine routes, need sqlite 3.25
+            if dialect.dbapi is None or dialect.dbapi.sqlite_version_info<(3,25,0):
+                return False
+        elif dialect.name!='postgresql':
+            return False
+
+        return self._overridden_steps_declare('_recursive_query_compatible')
+
+    def _overridden_steps_declare(self, compatibility_attribute):
+        """Return True if every class defining a step of the hop-by-hop engine declares the compatibility attribute"""
+        for step in self._hop_by_hop_steps:
+            defining_class = next((c for c in type(self).__mro__ if step in c.__dict__), None)
+            if defining_class is not None and not defining_class.__dict__.get(compatibility_attribute, False):
+                return False
+        return True
+
+    def _recursive_link_filter(self, link, timestep_old, timestep_new):
+        """Return the condition under which a link may be followed by the recursive engine.
+
+        This is the equivalent of _generate_link_filter, other than the aggregated weight threshold."""
+        condition = link.c.weight > self._min_onehop_weight
+        if self._one_simulation:
+            condition &= (timestep_new.c.simulation_id == timestep_old.c.simulation_id)
+        if self.directed.lower() == 'backwards':
+            condition &= (timestep_new.c.time_gyr < timestep_old.c.time_gyr*(1.0-SMALL_FRACTION))
+        else:
+            condition &= (timestep_new.c.time_gyr > timestep_old.c.time_gyr*(1.0+SMALL_FRACTION))
+        return condition
+
+    def _recursive_link_choice_order(self, candidates):
+        """Return an ordering (in terms of the columns of candidates, a _RecursiveCandidateLinks) such that the
+        recursive engine follows only the first permitted link from each halo, or None if every permitted link must
+        be followed, in which case the recursive engine is not used"""
+        return None
+
+    def _recursive_seed(self):
+        seed = sqlalchemy.select([sqlalchemy.literal(self.halo_from.id).label('halo_from_id'),
+                                  sqlalchemy.literal(self.halo_from.id).label('halo_to_id'),
+                                  sqlalchemy.literal(1.0, Float).label('weight'),
+                                  sqlalchemy.literal(0).label('nhops'),
+                                  sqlalchemy.cast(sqlalchemy.null(), Integer).label('source_id')])
+        return seed.cte('multihop_routes', recursive=True)
+
+    def _recursive_candidate_links(self, routes):
+        link = core.halo_data.HaloLink.__table__.alias()
+        halo_old = core.halo.Halo.__table__.alias()
+        halo_new = core.halo.Halo.__table__.alias()
+        timestep_old = core.timestep.TimeStep.__table__.alias()
+        timestep_new = core.timestep.TimeStep.__table__.alias()
+
+        from_clause = link.join(halo_old, link.c.halo_from_id == halo_old.c.id). \
+            join(halo_new, link.c.halo_to_id == halo_new.c.id). \
+            join(timestep_old, halo_old.c.timestep_id == timestep_old.c.id). \
+            join(timestep_new, halo_new.c.timestep_id == timestep_new.c.id)
+
+        condition = (link.c.halo_from_id == routes.c.halo_to_id) & (routes.c.nhops < self.nhops_max) & \
+                    (routes.c.weight * link.c.weight > self._min_aggregated_weight) & \
+                    self._recursive_link_filter(link, timestep_old, timestep_new)
+
+        if self._min_onehop_reverse_weight is not None:
+            reverse_link = core.halo_data.HaloLink.__table__.alias()
+            from_clause = from_clause.join(reverse_link, and_(reverse_link.c.halo_from_id == link.c.halo_to_id,
+                                                              reverse_link.c.halo_to_id == link.c.halo_from_id))
+            condition &= reverse_link.c.weight > self._min_onehop_reverse_weight
+
+        return _RecursiveCandidateLinks(from_clause, condition, link, halo_new, timestep_new)
+
+    def _make_hops_with_recursive_query(self):
+        """Take all the hops in a single statement, populating the same table as the hop-by-hop engine"""
+        routes = self._recursive_seed()
+
+        # only one link is followed from each halo (see _recursive_query_available), so there is never more than
+        # one route to combine
+        candidates = self._recursive_candidate_links(routes)
+        link = core.halo_data.HaloLink.__table__.alias()
+        best_link_id = sqlalchemy.select([candidates.link.c.id]).select_from(candidates.from_clause). \
+            where(candidates.condition).order_by(*self._recursive_link_choice_order(candidates)).limit(1).as_scalar()
+
+        routes = routes.union_all(sqlalchemy.select([link.c.halo_from_id, link.c.halo_to_id,
+                                                     routes.c.weight * link.c.weight,
+                                                     routes.c.nhops + 1, routes.c.source_id]).
+                                  select_from(routes.join(link, link.c.id == best_link_id)))
+
+        columns = ['halo_from_id', 'halo_to_id', 'weight', 'nhops', 'source_id']
+        results = sqlalchemy.select([routes.c[c] for c in columns])
+        self._connection.execute(self._table.insert().from_select(columns, results))
+
+    def _main_branch_index_available(self):
+        """Return True if the results can be read from the main branch index by _make_hops_with_main_branch_index"""
+        return False
+
+    def _link_graph_available(self):
+        if not config.use_link_graph:
+            return False
+        # the graph holds the links from one simulation only
+        if self.directed is None or self.directed.lower() not in ('backwards', 'forwards') \
+                or not self._one_simulation:
+            return False
+        return self._overridden_steps_declare('_link_graph_compatible')
+
+    def _link_graph_seeds(self):
+        """Return the halo ids to start from, and the corresponding source ids (or None)"""
+        return [self.halo_from.id], [None]
+
+    def _link_graph_should_halt(self, graph, levels):
+        """Return True to stop the in-memory traversal, given the list of _GraphHops so far"""
+        return False
+
+    def _link_graph_filter(self, graph, hops):
+        """Return a mask for the candidate hops (a _GraphHops) which may be taken; the equivalent of
+        _generate_link_filter, other than the weight thresholds"""
+        time_old = graph.node_time[hops.from_node]
+        time_new = graph.node_time[hops.to_node]
+        mask = graph.node_simulation_id[hops.to_node] == graph.node_simulation_id[hops.from_node]
+        if self.directed.lower() == 'backwards':
+            mask &= time_new < time_old*(1.0-SMALL_FRACTION)
+        else:
+            mask &= time_new > time_old*(1.0+SMALL_FRACTION)
+        return mask
+
+    def _link_graph_select(self, graph, hops):
+        """Return the indices of the filtered hops (a _GraphHops) to keep at each level"""
+        return np.arange(len(hops))
+
+    def _link_graph_next_level(self, graph, level):
+        position, link = graph.links_from(level.to_node)
+        hops = _GraphHops(level.to_node[position], graph.link_to[link], level.weight[position]*graph.link_weight[link],
+                          level.source[position])
+        hops = hops.take(graph.link_weight[link] > self._min_onehop_weight)
+
+        if self._combine_routes:
+            # keep only the strongest route to each halo
+            order = np.lexsort((-hops.weight, hops.source, hops.to_node))
+            sorted_keys = np.stack((hops.to_node[order], hops.source[order]))
+            first = np.concatenate(([True], np.any(sorted_keys[:, 1:]!=sorted_keys[:, :-1], axis=0))) \
+                if len(order)>0 else np.zeros(0, dtype=bool)
+            hops = hops.take(np.sort(order[first]))
+
+        mask = hops.weight > self._min_aggregated_weight
+        if self._min_onehop_reverse_weight is not None:
+            mask &= graph.reverse_link_weight(hops.from_node, hops.to_node) > self._min_onehop_reverse_weight
+        mask &= self._link_graph_filter(graph, hops)
+        hops = hops.take(mask)
+
+        return hops.take(self._link_graph_select(graph, hops))
+
+    def _make_hops_with_link_graph(self):
+        """Take all the hops in memory, then populate the same table as the hop-by-hop engine"""
+        graph = link_graph.get_link_graph(self.session, self.halo_from.timestep.simulation_id)
+        seed_halo_ids, seed_sources = self._link_graph_seeds()
+        seed_nodes = graph.node_index(seed_halo_ids)
+        sources = np.array([-1 if s is None else s for s in seed_sources], dtype=np.int64)
+        levels = [_GraphHops(seed_nodes, seed_nodes, np.ones(len(seed_nodes)), sources)]
+
+        for i in range(0, self.nhops_max):
+            if self._link_graph_should_halt(graph, levels):
+                break
+            next_level = self._link_graph_next_level(graph, levels[-1])
+            if len(next_level)==0:
+                break
+            levels.append(next_level)
+        self._nhops_taken = i
+
+        rows = [{'halo_from_id': halo_id, 'halo_to_id': halo_id, 'weight': 1.0, 'nhops': 0, 'source_id': source}
+                for halo_id, source in zip(seed_halo_ids, seed_sources)]
+        for nhops, level in enumerate(levels[1:], 1):
+            for from_id, to_id, weight, source in zip(graph.node_halo_id[level.from_node],
+                                                      graph.node_halo_id[level.to_node],
+                                                      level.weight, level.source):
+                rows.append({'halo_from_id': int(from_id), 'halo_to_id': int(to_id), 'weight': float(weight),
+                             'nhops': nhops, 'source_id': None if source==-1 else int(source)})
+
+        if len(rows)>0:
+            self._connection.execute(self._table.insert(), rows)
+
     def _construct_orm_class(self):
         rstr = ''.join(random.choice(string.ascii_lowercase) for _ in range(4))
         class_name = "MultiHopHaloLink_"+rstr
@@ -1,9 +1,17 @@
+import numpy as np
+import sqlalchemy
+
 from .multi_hop import MultiHopStrategy
+from .. import core, config
 from ..config import num_multihops_max_default as NHOPS_MAX_DEFAULT
 
 
 class MultiHopAllProgenitorsStrategy(MultiHopStrategy):
     """Finds all progenitors for a halo at every step"""
+
+    # links are only followed if there is a link back to the starting halo with at least this weight
+    progenitor_reverse_weight_threshold = 0.1
+
     def __init__(self, halo_from, nhops_max=NHOPS_MAX_DEFAULT, include_startpoint=False, target='auto',
                  combine_routes=True, order_by=None, one_simulation=None):
         if order_by is None:
@@ -17,9 +25,13 @@ class MultiHopAllProgenitorsStrategy(MultiHopStrategy):
                                                                target=target,
                                                                order_by=order_by,
                                                                combine_routes=combine_routes,
-                                                             min_onehop_reverse_weight=0.1,
+                                                             min_onehop_reverse_weight=self.progenitor_reverse_weight_threshold,
                                                              one_simulation=one_simulation)
 
+    _recursive_query_compatible = True
+    _link_graph_compatible = True
+    _main_branch_index_compatible = True
+
     def _supplement_halolink_query_with_filter(self, query, table):
         query = super(MultiHopAllProgenitorsStrategy, self)._supplement_halolink_query_with_filter(query, table)
         if self._target is None:
@@ -27,15 +39,72 @@ class MultiHopAllProgenitorsStrategy(MultiHopStrategy):
         else:
             return query.filter(self.timestep_new.simulation_id == self.sim_id)
 
+    def _recursive_link_filter(self, link, timestep_old, timestep_new):
+        condition = super(MultiHopAllProgenitorsStrategy, self)._recursive_link_filter(link, timestep_old, timestep_new)
+        if self._target is None:
+            return condition
+        else:
+            return condition & (timestep_new.c.simulation_id == self.sim_id)
+
+    def _link_graph_filter(self, graph, hops):
+        mask = super(MultiHopAllProgenitorsStrategy, self)._link_graph_filter(graph, hops)
+        if self._target is None:
+            return mask
+        else:
+            return mask & (graph.node_simulation_id[hops.to_node] == self.sim_id)
+
 
 class MultiHopMajorProgenitorsStrategy(MultiHopAllProgenitorsStrategy):
     """Finds the major progenitor for a halo at every step"""
 
+    _recursive_query_compatible = True
+    _link_graph_compatible = True
+    _main_branch_index_compatible = True
+
     def _supplement_halolink_query_with_filter(self, query, table):
         query = super(MultiHopMajorProgenitorsStrategy, self)._supplement_halolink_query_with_filter(query, table)
         return query.order_by(self.timestep_new.time_gyr.desc(), table.c.weight.desc(), self.halo_new.halo_number). \
             limit(1)
 
+    def _main_branch_index_available(self):
+        if not config.use_main_branch_index or not self._one_simulation:
+            return False
+        if not self._overridden_steps_declare('_main_branch_index_compatible'):
+            return False
+        if not core.main_branch.main_branch_index_is_current(self.session, self.sim_id):
+            return False
+        self._main_branch_position = core.main_branch.get_main_branch_position(self.session, self.halo_from.id)
+        return self._main_branch_position is not None
+
+    def _make_hops_with_main_branch_index(self):
+        """Read the branch from the main branch index, then populate the same table as the hop-by-hop engine"""
+        root_id, depth = self._main_branch_position
+        entries = core.main_branch.MainBranchEntry.__table__
+        branch = self._connection.execute(sqlalchemy.select([entries.c.halo_id, entries.c.weight]).
+                                          where((entries.c.root_id == root_id) &
+                                                (entries.c.depth.between(depth, depth+self.nhops_max))).
+                                          order_by(entries.c.depth)).fetchall()
+
+        rows = []
+        halo_from_id, weight = branch[0][0], 1.0
+        for nhops, (halo_id, link_weight) in enumerate(branch):
+            if nhops>0:
+                weight*=link_weight
+            rows.append({'halo_from_id': halo_from_id, 'halo_to_id': halo_id, 'weight': weight, 'nhops': nhops,
+                         'source_id': None})
+            halo_from_id = halo_id
+        self._nhops_taken = len(branch)-1
+
+        self._connection.execute(self._table.insert(), rows)
+
+    def _recursive_link_choice_order(self, candidates):
+        return [candidates.timestep_new.c.time_gyr.desc(), candidates.link.c.weight.desc(),
+                candidates.halo_new.c.halo_number]
+
+    def _link_graph_select(self, graph, hops):
+        order = np.lexsort((graph.node_halo_number[hops.to_node], -hops.weight, -graph.node_time[hops.to_node]))
+        return order[:1]
+
 class MultiHopMostRecentMergerStrategy(MultiHopAllProgenitorsStrategy):
     """Finds the halos involved in the most recent merger into the major progenitor branch of the halo"""
 
@@ -64,10 +133,30 @@ class MultiHopMajorDescendantsStrategy(MultiHopStrategy):
                                                                target=halo_from.timestep.simulation,
                                                                **kwargs)
 
+    _recursive_query_compatible = True
+    _link_graph_compatible = True
+
     def _supplement_halolink_query_with_filter(self, query, table):
         query = super(MultiHopMajorDescendantsStrategy, self)._supplement_halolink_query_with_filter(query, table)
         return query.filter(self.timestep_new.simulation_id == self.sim_id). \
             order_by(self.timestep_new.time_gyr, table.c.weight.desc(), self.halo_new.halo_number). \
             limit(1)
 
+    def _recursive_link_filter(self, link, timestep_old, timestep_new):
+        condition = super(MultiHopMajorDescendantsStrategy, self)._recursive_link_filter(link, timestep_old,
+                                                                                         timestep_new)
+        return condition & (timestep_new.c.simulation_id == self.sim_id)
+
+    def _recursive_link_choice_order(self, candidates):
+        return [candidates.timestep_new.c.time_gyr, candidates.link.c.weight.desc(),
+                candidates.halo_new.c.halo_number]
+
+    def _link_graph_filter(self, graph, hops):
+        mask = super(MultiHopMajorDescendantsStrategy, self)._link_graph_filter(graph, hops)
+        return mask & (graph.node_simulation_id[hops.to_node] == self.sim_id)
+
+    def _link_graph_select(self, graph, hops):
+        order = np.lexsort((graph.node_halo_number[hops.to_node], -hops.weight, graph.node_time[hops.to_node]))
+        return order[:1]
+
 
@@ -7,6 +7,7 @@ from .one_hop import HopStrategy
 from six.moves import range
 from six.moves import zip
 
+import numpy as np
 import sqlalchemy
 from sqlalchemy import func, orm
 
@@ -20,6 +21,8 @@ class MultiSourceMultiHopStrategy(MultiHopStrategy):
     Additionally, as soon as any halo is "matched" in the target, the entire query is stopped. In other words,
     this class assumes that the number of hops is the same to reach all target halos."""
 
+    _link_graph_compatible = True
+
     def __init__(self, halos_from, target, **kwargs):
         """Construct a strategy for finding Halos via multiple "hops" along HaloLinks from multiple start-points
 
@@ -110,6 +113,32 @@ class MultiSourceMultiHopStrategy(MultiHopStrategy):
     def _should_halt(self):
         return self.query.count()>0
 
+    def _link_graph_seeds(self):
+        return [halo_from.id for halo_from in self._all_halo_from], list(range(len(self._all_halo_from)))
+
+    def _link_graph_should_halt(self, graph, levels):
+        # equivalent to _should_halt: has any result reached the target yet?
+        if not self._include_startpoint:
+            levels = levels[1:]
+        for level in levels:
+            reached = level.to_node[level.to_node>=0]
+            if isinstance(self._target, core.timestep.TimeStep):
+                if np.any(graph.node_timestep_id[reached] == self._target.id):
+                    return True
+            elif isinstance(self._target, core.simulation.Simulation):
+                if np.any(graph.node_simulation_id[reached] == self._target.id):
+                    return True
+        return False
+
+    def _link_graph_select(self, graph, hops):
+        if not self._keep_only_highest_weights_per_hop:
+            return np.arange(len(hops))
+        # equivalent to _extract_max_weight_rows_from_query: the strongest link for each source
+        order = np.lexsort((-hops.weight, hops.source))
+        first = np.concatenate(([True], hops.source[order][1:]!=hops.source[order][:-1])) if len(order)>0 \
+            else np.zeros(0, dtype=bool)
+        return np.sort(order[first])
+
     def _order_by_clause(self, halo_alias, timestep_alias):
         return [self._link_orm_class.source_id] \
                + super(MultiSourceMultiHopStrategy, self)._order_by_clause(halo_alias, timestep_alias)
@@ -171,9 +200,14 @@ class MultiSourceMultiHopStrategy(MultiHopStrategy):
 
 class MultiSourceAllMajorProgenitorsStrategy(MultiSourceMultiHopStrategy):
 
+    _link_graph_compatible = True
+
     def __init__(self, halos_from, **kwargs):
         super(MultiSourceAllMajorProgenitorsStrategy, self).__init__(halos_from, None, one_match_per_input=False,
                                                                      directed='backwards', include_startpoint=True)
 
     def _should_halt(self):
+        return False
+
+    def _link_graph_should_halt(self, graph, levels):
         return False
\ No newline at end of file
@@ -6,6 +6,7 @@ import sys
 
 import numpy as np
 import argparse
+import sqlalchemy
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
@@ -198,6 +199,32 @@ def remove_duplicates(opts):
 
 
 
+def migrate_array_storage(options):
+    from tangos.core.data_attribute_mapper import repack_array
+    session = db.core.get_default_session()
+    for table in HaloProperty.__table__, SimulationProperty.__table__:
+        last_id = -1
+        n_converted = 0
+        while True:
+            rows = session.execute(table.select().with_only_columns([table.c.id, table.c.data_array]).
+                                   where((table.c.id>last_id) & (table.c.data_array != None)).
+                                   order_by(table.c.id).limit(options.chunk_size)).fetchall()
+            if len(rows)==0:
+                break
+            last_id = rows[-1][0]
+            updates = []
+            for row_id, packed in rows:
+                repacked = repack_array(packed)
+                if repacked is not None:
+                    updates.append({'row_id': row_id, 'new_data': repacked})
+            if len(updates)>0:
+                session.execute(table.update().where(table.c.id==sqlalchemy.bindparam('row_id')).
+                                values(data_array=sqlalchemy.bindparam('new_data')), updates)
+                session.commit()
+            n_converted+=len(updates)
+        logger.info("Converted %d arrays in table %s", n_converted, table.name)
+
+
 def rem_simulation_timesteps(options):
     basename = options.sims
     from tangos.util.terminalcontroller import term
@@ -470,6 +497,12 @@ def get_argument_parser_and_subparsers():
                                              help="Remove old copies of properties (if they are present)")
     subparse_deprecate.set_defaults(func=remove_duplicates)
 
+    subparse_migrate_arrays = subparse.add_parser("migrate-arrays",
+                                                  help="Convert stored arrays to the current storage format (see config.array_storage_format)")
+    subparse_migrate_arrays.add_argument("--chunk-size", type=int, default=10000,
+                                         help="The number of rows to convert in each transaction")
+    subparse_migrate_arrays.set_defaults(func=migrate_array_storage)
+
     subparse_rollback = subparse.add_parser("rollback", help="Remove database updates")
     subparse_rollback.add_argument("ids", nargs="*", type=int, help="IDs of the database updates to remove. If none specified, removes the most recent run.")
     subparse_rollback.add_argument("--force", "-f", action="store_true", help="If this flag is present, no confirmation prompts will be issued")
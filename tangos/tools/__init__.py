@@ -64,4 +64,5 @@ class GenericTangosTool(object):
         for c in cls.__subclasses__():
             c.add_tools(subparse)
 
-from . import add_simulation, consistent_trees_importer, crosslink, property_importer, property_writer
\ No newline at end of file
+from . import add_simulation, consistent_trees_importer, crosslink, main_branch_builder, property_importer, \
+    property_writer
\ No newline at end of file
@@ -0,0 +1,112 @@
+from __future__ import absolute_import
+
+import numpy as np
+
+import tangos as db
+from .. import core, config
+from ..core.main_branch import MainBranchEntry, MainBranchBuild, get_link_signature
+from ..relation_finding import link_graph
+from ..relation_finding.multi_hop_variants import MultiHopMajorProgenitorsStrategy
+from ..config import max_relative_time_difference as SMALL_FRACTION
+from ..log import logger
+from . import GenericTangosTool
+
+
+def major_progenitor_nodes(graph, simulation_id):
+    """Return the node index of the major progenitor of each node in graph (or -1 if there is none)
+
+    The choice of progenitor is the same as that made at each step by MultiHopMajorProgenitorsStrategy."""
+    n_nodes = len(graph.node_halo_id)
+    link_from = np.repeat(np.arange(n_nodes), np.diff(graph.offsets))
+    link_to = graph.link_to
+
+    time_from = graph.node_time[link_from]
+    time_to = graph.node_time[link_to]
+    allowed = (graph.link_weight > 0) & \
+              (graph.node_simulation_id[link_from] == simulation_id) & \
+              (graph.node_simulation_id[link_to] == simulation_id) & \
+              (time_to < time_from*(1.0-SMALL_FRACTION)) & \
+              (graph.reverse_link_weight(link_from, link_to) >
+               MultiHopMajorProgenitorsStrategy.progenitor_reverse_weight_threshold)
+    allowed = np.where(allowed)[0]
+
+    # most recent timestep first, then highest weight, then lowest halo number
+    order = np.lexsort((graph.node_halo_number[link_to[allowed]], -graph.link_weight[allowed],
+                        -time_to[allowed], link_from[allowed]))
+    chosen = allowed[order]
+    first = np.concatenate(([True], link_from[chosen][1:]!=link_from[chosen][:-1])) if len(chosen)>0 \
+        else np.zeros(0, dtype=bool)
+    chosen = chosen[first]
+
+    progenitor = np.repeat(-1, n_nodes)
+    progenitor_weight = np.zeros(n_nodes)
+    progenitor[link_from[chosen]] = link_to[chosen]
+    progenitor_weight[link_from[chosen]] = graph.link_weight[chosen]
+    return progenitor, progenitor_weight
+
+def main_branch_rows(graph, simulation_id):
+    """Generate (root_id, depth, halo_id, timestep_id, weight) for every main branch in the simulation"""
+    progenitor, progenitor_weight = major_progenitor_nodes(graph, simulation_id)
+
+    nodes = np.where(graph.node_simulation_id == simulation_id)[0]
+    # start from the latest halos, so that each branch is as long as possible
+    nodes = nodes[np.lexsort((graph.node_halo_number[nodes], -graph.node_time[nodes]))]
+
+    visited = np.zeros(len(graph.node_halo_id), dtype=bool)
+    for root in nodes:
+        if visited[root]:
+            continue
+        root_id = int(graph.node_halo_id[root])
+        node, depth, weight = root, 0, 1.0
+        while True:
+            # a halo already in another branch is listed again, so that every branch is complete
+            visited[node] = True
+            yield root_id, depth, int(graph.node_halo_id[node]), int(graph.node_timestep_id[node]), weight
+            if progenitor[node]<0:
+                break
+            node, depth, weight = progenitor[node], depth+1, float(progenitor_weight[node])
+
+def build_main_branches(session, simulation):
+    """Compute and store the main branch index for a simulation, replacing any existing index"""
+    link_signature = get_link_signature(session, simulation.id)
+    graph = link_graph.LinkGraph(session, simulation.id, link_signature)
+
+    timestep_ids = [ts.id for ts in simulation.timesteps]
+    entries = MainBranchEntry.__table__
+    session.execute(entries.delete().where(entries.c.timestep_id.in_(timestep_ids)))
+    session.query(MainBranchBuild).filter_by(simulation_id=simulation.id).delete()
+
+    columns = ['root_id', 'depth', 'halo_id', 'timestep_id', 'weight']
+    rows = [dict(zip(columns, row)) for row in main_branch_rows(graph, simulation.id)]
+    chunk_size = config.bulk_insert_chunk_size
+    for start in range(0, len(rows), chunk_size):
+        session.execute(entries.insert(), rows[start:start+chunk_size])
+
+    link_count, max_link_id = link_signature
+    session.add(MainBranchBuild(simulation_id=simulation.id, link_count=link_count, max_link_id=max_link_id))
+    session.commit()
+    return len(rows)
+
+
+class MainBranchBuilder(GenericTangosTool):
+    tool_name = 'build-branches'
+    tool_description = 'Precompute the major progenitor branches, speeding up later queries along them'
+    parallel = False
+
+    @classmethod
+    def add_parser_arguments(self, parser):
+        parser.add_argument('--sims', '--for', action='store', nargs='*',
+                            metavar='simulation_name',
+                            help='Specify a simulation (or multiple simulations) to run on')
+
+    def process_options(self, options):
+        self.options = options
+
+    def run_calculation_loop(self):
+        session = core.get_default_session()
+        simulations = db.sim_query_from_name_list(self.options.sims, session)
+
+        for simulation in simulations:
+            logger.info("Building main branches for %s", simulation)
+            n_rows = build_main_branches(session, simulation)
+            logger.info("%d main branch entries stored for %s", n_rows, simulation)
@@ -83,8 +83,8 @@ class PropertyImporter(GenericTangosTool):
         self._object_cache = timestep_object_cache.TimestepObjectCache(ts)
         self._session = core.Session.object_session(ts)
 
-        property_db_names = [core.dictionary.get_or_create_dictionary_item(self._session, name) for name in
-                             property_names]
+        property_db_name_map = core.dictionary.get_or_create_dictionary_items(self._session, property_names)
+        property_db_names = [property_db_name_map[name] for name in property_names]
         rows_to_store = []
         for values in self.handler.iterate_object_properties_for_timestep(ts.extension, object_typetag, property_names):
             db_object = self._object_cache.resolve(values[0], object_typetag)
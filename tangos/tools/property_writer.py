@@ -31,6 +31,45 @@ class AttributableDict(dict):
     pass
 
 
+class _ExistingProperties(AttributableDict):
+    """The existing properties of a halo, as passed to property calculations.
+
+    Some values (arrays, and anything that must be reassembled) are only retrieved from the database when they are
+    first accessed; until then they are represented in the dictionary by their HaloProperty id."""
+
+    def __init__(self):
+        super(_ExistingProperties, self).__init__()
+        self._unloaded = set()
+
+    def set_unloaded(self, name, property_id):
+        dict.__setitem__(self, name, property_id)
+        self._unloaded.add(name)
+
+    def __setitem__(self, name, value):
+        self._unloaded.discard(name)
+        dict.__setitem__(self, name, value)
+
+    def __getitem__(self, name):
+        if name in self._unloaded:
+            property_id = dict.__getitem__(self, name)
+            property_object = core.get_default_session().query(core.halo_data.HaloProperty).\
+                filter_by(id=property_id).first()
+            self[name] = property_object.data
+        return dict.__getitem__(self, name)
+
+    def get(self, name, default=None):
+        if name in self:
+            return self[name]
+        else:
+            return default
+
+    def values(self):
+        return [self[k] for k in self]
+
+    def items(self):
+        return [(k, self[k]) for k in self]
+
+
 class PropertyWriter(GenericTangosTool):
     tool_name = "write"
     tool_description = "Calculate properties and write them into the tangos database"
@@ -85,6 +124,8 @@ class PropertyWriter(GenericTangosTool):
                             help="Emulate MPI by handling slice N out of the total workload of M items. If absent, use real MPI.")
         parser.add_argument('--backend', action='store', type=str,
                             help="Specify the paralellism backend (e.g. pypar, mpi4py)")
+        parser.add_argument('--async-write', action='store_true',
+                            help="Send results to the manager process to be written to the database in the background, so that calculations do not wait for database access")
         parser.add_argument('--include-only', action='append', type=str,
                             help="Specify a filter that describes which objects the calculation should be executed for. Multiple filters may be specified, in which case they must all evaluate to true for the object to be included.")
 
@@ -141,7 +182,8 @@ class PropertyWriter(GenericTangosTool):
             # before all nodes have generated their local work lists
             parallel_tasks.barrier()
 
-            return parallel_tasks.distributed(items)
+            # largest halos first, so that the last few jobs of the timestep are quick
+            return parallel_tasks.distributed(items, costs=[db_halo.NDM or 0 for db_halo, _ in items])
         else:
             return items
 
@@ -184,14 +226,19 @@ class PropertyWriter(GenericTangosTool):
         if self.options.hmax is not None:
             query = sqlalchemy.and_(query, core.halo.Halo.halo_number<=self.options.hmax)
 
-        needed_properties = self._required_and_calculated_property_names()
+        # existing properties are gathered separately (see _build_existing_properties_all_halos), so the halo
+        # objects only need them pre-loaded if they are to be passed directly to a calculation
+        if any([x.no_proxies() for x in self._property_calculator_instances]):
+            needed_properties = self._required_and_calculated_property_names()
+        else:
+            needed_properties = []
 
         halo_query = core.get_default_session().query(core.halo.Halo).order_by(core.halo.Halo.halo_number).filter(query)
         if self._include:
             needed_properties.append(self._include)
 
-        logger.info('Gathering existing properties for all halos in timestep %r',db_timestep)
-        halo_query = live_calculation.MultiCalculation(*needed_properties).supplement_halo_query(halo_query)
+        if len(needed_properties)>0:
+            halo_query = live_calculation.MultiCalculation(*needed_properties).supplement_halo_query(halo_query)
 
         halos = halo_query.all()
 
@@ -210,16 +257,9 @@ class PropertyWriter(GenericTangosTool):
         return halos
 
 
-    def _build_existing_properties(self, db_halo):
-        existing_properties = db_halo.all_properties
-        need_data = self._required_and_calculated_property_names()
-        need_data_ids = [core.get_dict_id(x,None) for x in need_data]
-
-        existing_properties_data = AttributableDict()
-        for x in existing_properties:
-            if x.name_id in need_data_ids:
-                name = need_data[need_data_ids.index(x.name_id)]
-                existing_properties_data[name] = x.data
+    def _build_existing_properties(self, db_halo, existing_properties_data=None):
+        if existing_properties_data is None:
+            existing_properties_data = self._query_existing_properties([db_halo])[db_halo.id]
 
         existing_properties_data.halo_number = db_halo.halo_number
         existing_properties_data.NDM = db_halo.NDM
@@ -230,8 +270,56 @@ class PropertyWriter(GenericTangosTool):
         return existing_properties_data
 
     def _build_existing_properties_all_halos(self, halos):
-        return [self._build_existing_properties(h) for h in halos]
-        
+        logger.info('Gathering existing properties for all halos')
+        existing_properties = self._query_existing_properties(halos)
+        return [self._build_existing_properties(h, existing_properties[h.id]) for h in halos]
+
+    def _query_existing_properties(self, halos):
+        """Return a dictionary mapping the id of each halo onto an _ExistingProperties object.
+
+        The properties of all the halos are retrieved in a single query, which must be for halos in one timestep.
+        Scalar values are retrieved immediately, arrays only when first accessed."""
+        existing_properties = {h.id: _ExistingProperties() for h in halos}
+        if len(halos)==0:
+            return existing_properties
+
+        session = core.get_default_session()
+        timestep = halos[0].timestep
+        handler_class = timestep.simulation.output_handler_class
+        need_data = self._required_and_calculated_property_names()
+        name_ids = [core.get_dict_id(x, None, session=session) for x in need_data]
+        names = {name_id: x for name_id, x in zip(name_ids, need_data) if name_id is not None}
+        if len(names)==0:
+            return existing_properties
+        load_lazily = {name_id: self._requires_reassembly(name, handler_class) for name_id, name in names.items()}
+
+        halo_table = core.halo.Halo.__table__
+        property_table = core.halo_data.HaloProperty.__table__
+        query = sqlalchemy.select([property_table.c.halo_id, property_table.c.name_id, property_table.c.id,
+                                   property_table.c.data_float, property_table.c.data_int,
+                                   property_table.c.data_array.isnot(None)]).\
+            select_from(property_table.join(halo_table, property_table.c.halo_id==halo_table.c.id)).\
+            where((halo_table.c.timestep_id==timestep.id) & property_table.c.name_id.in_(list(names.keys()))).\
+            order_by(property_table.c.id)
+
+        for halo_id, name_id, property_id, data_float, data_int, has_array in session.execute(query):
+            existing_properties_data = existing_properties.get(halo_id, None)
+            if existing_properties_data is None:
+                continue
+            if has_array or load_lazily[name_id]:
+                existing_properties_data.set_unloaded(names[name_id], property_id)
+            else:
+                existing_properties_data[names[name_id]] = data_float if data_float is not None else data_int
+
+        return existing_properties
+
+    @staticmethod
+    def _requires_reassembly(name, handler_class):
+        try:
+            providing_class = properties.providing_class(name, handler_class)
+        except NameError:
+            return False
+        return hasattr(providing_class, 'reassemble')
 
     def _is_commit_needed(self, end_of_timestep, end_of_simulation):
         if len(self._pending_properties)==0:
@@ -246,15 +334,28 @@ class PropertyWriter(GenericTangosTool):
             return False
 
 
+    def _use_async_writer(self):
+        return self.options.async_write and parallel_tasks.parallel_backend_loaded()
+
     def _commit_results_if_needed(self, end_of_timestep=False, end_of_simulation=False):
 
         if self._is_commit_needed(end_of_timestep, end_of_simulation):
-            logger.info("Attempting to commit %d halo properties...", len(self._pending_properties))
-            insert_list(self._pending_properties)
-            logger.info("%d properties were committed", len(self._pending_properties))
+            if self._use_async_writer():
+                logger.info("Sending %d halo properties to the writer...", len(self._pending_properties))
+                parallel_tasks.async_writer.queue_for_writing(self._pending_properties)
+                logger.info("%d properties were accepted by the writer", len(self._pending_properties))
+            else:
+                logger.info("Attempting to commit %d halo properties...", len(self._pending_properties))
+                insert_list(self._pending_properties)
+                logger.info("%d properties were committed", len(self._pending_properties))
             self._pending_properties = []
             self._start_time = time.time()
             self.timing_monitor.summarise_timing(logger)
+            if self._use_async_writer():
+                parallel_tasks.async_writer.summarise_queue(logger)
+
+        if end_of_simulation and self._use_async_writer():
+            parallel_tasks.async_writer.flush()
 
     def _queue_results_for_later_commit(self, db_halo, names, results, existing_properties_data):
         for n, r in zip(names, results):
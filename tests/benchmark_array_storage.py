@@ -0,0 +1,55 @@
+"""Benchmark decoding of stored arrays in the pickle and columnar formats.
+
+Run directly, e.g.
+
+    python benchmark_array_storage.py --rows 1000000 --length 100
+
+The figures printed are the time to decode a million stored arrays, extrapolated from the number of rows actually
+decoded."""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import time
+
+import numpy as np
+
+import tangos.core.data_attribute_mapper as dam
+from tangos import config
+
+
+def _pack_rows(format, n_rows, length):
+    old_format = config.array_storage_format
+    config.array_storage_format = format
+    try:
+        mapper = dam.DataAttributeMapper(data=np.zeros(length))
+        # a small number of distinct arrays is enough; decoding cost does not depend on the values
+        distinct = [mapper.pack(np.random.uniform(size=length)) for i in range(min(n_rows, 100))]
+    finally:
+        config.array_storage_format = old_format
+    return [distinct[i%len(distinct)] for i in range(n_rows)]
+
+def _time_decode(packed_rows):
+    mapper = dam.DataAttributeMapper(data=np.zeros(2))
+    start = time.time()
+    for packed in packed_rows:
+        mapper.unpack(packed)
+    return time.time()-start
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark stored array decoding")
+    parser.add_argument("--rows", type=int, default=100000, help="Number of stored arrays to decode")
+    parser.add_argument("--length", type=int, nargs="+", default=[10, 100, 1000],
+                        help="Length of each stored array (several values may be given)")
+    args = parser.parse_args()
+
+    print("%10s | %10s | %24s"%("length", "format", "seconds per million rows"))
+    for length in args.length:
+        for format in 'pickle', 'columnar':
+            rows = _pack_rows(format, args.rows, length)
+            elapsed = _time_decode(rows)
+            print("%10d | %10s | %24.2f"%(length, format, elapsed*1e6/args.rows))
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Benchmark TimeStep.calculate_all on scalar properties, with and without the ORM-free fast path.
+
+Run directly, e.g.
+
+    python benchmark_calculate_all.py --halos 100000
+
+A timestep with the specified number of halos, each with a few scalar properties, is generated in a temporary
+database. The time taken by calculate_all for a number of typical property lists is then printed for the general
+route (which loads halo objects) and for the fast path."""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import tangos
+from tangos import core, config
+from tangos.testing import simulation_generator
+
+_PROPERTY_LISTS = [("Mvir",), ("Mvir", "Rvir"), ("Mvir/Rvir", "log10(Vmax)"), ("Mvir", "Vmax>100")]
+
+def _generate_timestep(n_halos):
+    session = core.get_default_session()
+    generator = simulation_generator.TestSimulationGenerator(session=session)
+    generator.add_timestep()
+    ts = tangos.get_timestep("sim/ts1")
+    creator_id = core.creator.get_creator_id()
+
+    halos = core.halo.Halo.__table__
+    session.execute(halos.insert(), [{'halo_number': i, 'finder_id': i, 'timestep_id': ts.id, 'NDM': 1000,
+                                      'NStar': 0, 'NGas': 0, 'halo_type': 0, 'creator_id': creator_id}
+                                     for i in range(1, n_halos+1)])
+    halo_ids = [row[0] for row in session.execute(halos.select().where(halos.c.timestep_id==ts.id))]
+
+    properties = core.halo_data.HaloProperty.__table__
+    for name, generate in [("Mvir", lambda n: 10**np.random.uniform(8, 13, n)),
+                           ("Rvir", lambda n: np.random.uniform(1, 300, n)),
+                           ("Vmax", lambda n: np.random.uniform(10, 500, n))]:
+        name_id = core.dictionary.get_or_create_dictionary_item(session, name).id
+        values = generate(len(halo_ids))
+        session.execute(properties.insert(), [{'halo_id': halo_id, 'name_id': name_id, 'creator_id': creator_id,
+                                               'deprecated': False, 'data_float': float(value)}
+                                              for halo_id, value in zip(halo_ids, values)])
+    session.commit()
+    return ts
+
+def _time_calculate_all(ts, property_list, fast_path):
+    old_setting = config.calculate_all_fast_path
+    config.calculate_all_fast_path = fast_path
+    try:
+        start = time.time()
+        ts.calculate_all(*property_list)
+        return time.time()-start
+    finally:
+        config.calculate_all_fast_path = old_setting
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark calculate_all on scalar properties")
+    parser.add_argument("--halos", type=int, default=100000, help="Number of halos in the generated timestep")
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp()
+    try:
+        core.init_db("sqlite:///"+os.path.join(db_dir, "benchmark.db"))
+        ts = _generate_timestep(args.halos)
+
+        print("%30s | %12s | %12s | %8s"%("properties", "general (s)", "fast (s)", "speedup"))
+        for property_list in _PROPERTY_LISTS:
+            general = _time_calculate_all(ts, property_list, False)
+            fast = _time_calculate_all(ts, property_list, True)
+            print("%30s | %12.3f | %12.3f | %8.1f"%(", ".join(property_list), general, fast, general/fast))
+    finally:
+        shutil.rmtree(db_dir)
+
+if __name__=="__main__":
+    main()
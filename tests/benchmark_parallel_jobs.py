@@ -0,0 +1,49 @@
+"""Benchmark the distribution of jobs by parallel_tasks, handing out one job at a time or in shrinking chunks.
+
+Run directly, e.g.
+
+    python benchmark_parallel_jobs.py --jobs 100000 --processes 8
+
+Each job in the loop takes a negligible (or, with --job-time, a specified) time, so that the time taken is dominated
+by the round trips to the manager rank. The loop is timed using the multiprocessing backend with
+config.parallel_job_chunk_factor set to None (one job per request) and to its default value."""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import logging
+import time
+
+from tangos import config
+from tangos.log import logger
+from tangos import parallel_tasks as pt
+
+_DEFAULT_CHUNK_FACTOR = config.parallel_job_chunk_factor
+
+def _run_loop(n_jobs, job_time):
+    start = time.time()
+    for _ in pt.distributed(list(range(n_jobs))):
+        if job_time>0:
+            time.sleep(job_time)
+    if pt.backend.rank()==1:
+        print("%30s | %12.3f" % ("chunk factor %r" % config.parallel_job_chunk_factor, time.time()-start))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark distribution of jobs with parallel_tasks")
+    parser.add_argument("--jobs", type=int, default=100000, help="Number of jobs in the loop")
+    parser.add_argument("--processes", type=int, default=8, help="Number of processes, including the manager")
+    parser.add_argument("--job-time", type=float, default=0.0, help="Time in seconds taken by each job")
+    args = parser.parse_args()
+
+    # the manager logs every request, which would otherwise dominate the timing
+    logger.setLevel(logging.WARNING)
+    pt.use("multiprocessing")
+    print("%30s | %12s" % ("distribution", "time (s)"))
+    for chunk_factor in None, _DEFAULT_CHUNK_FACTOR:
+        config.parallel_job_chunk_factor = chunk_factor
+        pt.launch(_run_loop, args.processes, [args.jobs, args.job_time])
+    config.parallel_job_chunk_factor = _DEFAULT_CHUNK_FACTOR
+
+if __name__=="__main__":
+    main()
@@ -9,6 +9,7 @@ import pynbody
 from nose.tools import assert_raises
 
 import tangos.core.data_attribute_mapper as dam
+from tangos import config
 import six
 
 
@@ -107,6 +108,14 @@ def test_struct_time():
     assert_data_value(target.data,  datetime.datetime(*test_time[:6]))
 
 def test_array_pack_format():
+    old_format = config.array_storage_format
+    config.array_storage_format = 'pickle'
+    try:
+        _test_pickle_array_pack_format()
+    finally:
+        config.array_storage_format = old_format
+
+def _test_pickle_array_pack_format():
     target = TestTarget()
     test_data=np.array([1,2,3])
     target.data=test_data
@@ -119,6 +128,52 @@ def test_array_pack_format():
     assert target.data_array.endswith(zlib.compress(pickle.dumps(test_data)))
     assert np.allclose(target.data, test_data)
 
+def test_columnar_pack_format():
+    target = TestTarget()
+    test_data = np.array([[1.0,2.0,3.0],[4.0,5.0,6.0]],dtype=np.float32)
+    target.data = test_data
+    assert target.data_array.startswith(b"CX")
+    assert target.data_array.endswith(test_data.tobytes())
+    retrieved = target.data
+    assert retrieved.dtype==np.float32
+    assert retrieved.shape==(2,3)
+    assert (retrieved==test_data).all()
+    # retrieved arrays can be modified in place, as pickled arrays can
+    retrieved/=2
+    assert (retrieved==test_data/2).all()
+
+def test_columnar_compressed():
+    target = TestTarget()
+    test_data = np.arange(2000)
+    target.data = test_data
+    assert target.data_array.startswith(b"CX")
+    assert len(target.data_array)<test_data.nbytes
+    retrieved = target.data
+    assert retrieved.dtype==test_data.dtype
+    assert (retrieved==test_data).all()
+    retrieved+=1
+    assert (retrieved==test_data+1).all()
+
+def test_columnar_not_used_for_object_arrays():
+    target = TestTarget()
+    target.data = np.array([1, "hello"], dtype=object)
+    assert target.data_array.startswith(b"PX")
+    assert target.data[1]=="hello"
+
+def test_repack_array():
+    test_data = np.arange(2000)
+    old_packed = b"ZX" + zlib.compress(pickle.dumps(test_data))
+    new_packed = dam.repack_array(old_packed)
+    assert new_packed.startswith(b"CX")
+    assert dam.repack_array(new_packed) is None
+
+    target = TestTarget()
+    target.data_array = new_packed
+    assert (target.data==test_data).all()
+
+    simarray_packed = b"PX" + pickle.dumps(pynbody.array.SimArray([1, 2, 3], "kpc"))
+    assert dam.repack_array(simarray_packed) is None
+
 def test_none():
     target = TestTarget()
     assert target.data is None
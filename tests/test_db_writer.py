@@ -2,6 +2,7 @@ from __future__ import absolute_import
 import tangos as db
 import tangos.config
 import os
+import numpy as np
 from tangos.tools import add_simulation
 from tangos.tools import property_writer
 from tangos.input_handlers import output_testing
@@ -105,4 +106,103 @@ def test_no_duplication():
     run_writer_with_args("dummy_property") # should not create duplicates
     assert db.get_default_session().query(db.core.HaloProperty).count() == 15
     run_writer_with_args("dummy_property", "--force")  # should create duplicates
-    assert db.get_default_session().query(db.core.HaloProperty).count() == 30
\ No newline at end of file
+    assert db.get_default_session().query(db.core.HaloProperty).count() == 30
+
+def test_orm_insert_fallback():
+    init_blank_simulation()
+    tangos.config.bulk_insert = False
+    try:
+        run_writer_with_args("dummy_property")
+    finally:
+        tangos.config.bulk_insert = True
+    _assert_properties_as_expected()
+    assert db.get_default_session().query(db.core.HaloProperty).count() == 15
+
+def test_bulk_insert_properties_and_links():
+    from tangos import cached_writer
+    import numpy as np
+    init_blank_simulation()
+    h1 = db.get_halo("dummy_sim_1/step.1/1")
+    h2 = db.get_halo("dummy_sim_1/step.2/1")
+    cached_writer.insert_list([(h1, "bulk_float", 2.5), (h1, "bulk_int", 3), (h2.id, "bulk_array", np.arange(5)),
+                               (h1, "bulk_link", h2), (h1, "bulk_none", None)])
+
+    h1 = db.get_halo("dummy_sim_1/step.1/1")
+    assert h1['bulk_float'] == 2.5
+    assert h1['bulk_int'] == 3
+    assert h1['bulk_link'] == h2
+    assert 'bulk_none' not in h1.keys()
+    assert (db.get_halo("dummy_sim_1/step.2/1")['bulk_array'] == np.arange(5)).all()
+    assert h1.get_objects("bulk_float")[0].creator_id == db.core.creator.get_creator_id()
+
+def test_insert_link_target_by_id():
+    from tangos import cached_writer
+    init_blank_simulation()
+    h1 = db.get_halo("dummy_sim_1/step.1/1")
+    h2 = db.get_halo("dummy_sim_1/step.2/1")
+    for bulk_insert in True, False:
+        tangos.config.bulk_insert = bulk_insert
+        try:
+            cached_writer.insert_list([(h1, "link_by_id_%s"%bulk_insert, cached_writer.LinkTarget(h2.id))])
+        finally:
+            tangos.config.bulk_insert = True
+        assert db.get_halo("dummy_sim_1/step.1/1")["link_by_id_%s"%bulk_insert] == h2
+
+def test_async_writing():
+    init_blank_simulation()
+    parallel_tasks.use('multiprocessing')
+    try:
+        parallel_tasks.launch(run_writer_with_args,3,["dummy_property", "--async-write"])
+    finally:
+        parallel_tasks.use('null')
+    _assert_properties_as_expected()
+    assert db.get_default_session().query(db.core.HaloProperty).count() == 15
+
+def test_async_writing_with_backpressure():
+    init_blank_simulation()
+    old_max_queue = tangos.config.async_writer_max_queue_rows
+    tangos.config.async_writer_max_queue_rows = 0
+    parallel_tasks.use('multiprocessing')
+    try:
+        parallel_tasks.launch(run_writer_with_args,3,["dummy_property", "--async-write"])
+    finally:
+        parallel_tasks.use('null')
+        tangos.config.async_writer_max_queue_rows = old_max_queue
+    _assert_properties_as_expected()
+
+class DummyArrayProperty(properties.PropertyCalculation):
+    names = "dummy_array_property",
+
+    def calculate(self, data, entry):
+        return np.arange(entry['halo_number']),
+
+class DummyPropertyRequiringArray(properties.PropertyCalculation):
+    names = "dummy_property_requiring_array",
+
+    def requires_property(self):
+        return "dummy_array_property", "dummy_property"
+
+    def calculate(self, data, entry):
+        return entry['dummy_array_property'].sum()+entry['dummy_property'],
+
+def test_existing_properties():
+    init_blank_simulation()
+    run_writer_with_args("dummy_property", "dummy_array_property")
+
+    writer = property_writer.PropertyWriter()
+    writer.parse_command_line(["dummy_property", "dummy_array_property"])
+    writer._property_calculator_instances = properties.instantiate_classes(db.get_simulation("dummy_sim_1"),
+                                                                         ["dummy_property", "dummy_array_property"])
+    halos = db.get_timestep("dummy_sim_1/step.2").halos.order_by(db.core.halo.Halo.halo_number).all()
+    existing = writer._build_existing_properties_all_halos(halos)
+    assert len(existing)==len(halos)
+    assert existing[1]['dummy_property'] == 4.0
+    assert existing[1].halo_number == 2
+    # arrays are retrieved only on access
+    assert 'dummy_array_property' in existing[1]
+    assert 'dummy_array_property' in existing[1]._unloaded
+    assert (existing[1]['dummy_array_property'] == np.arange(2)).all()
+    assert 'dummy_array_property' not in existing[1]._unloaded
+
+    run_writer_with_args("dummy_property_requiring_array")
+    assert db.get_halo("dummy_sim_1/step.2/2")['dummy_property_requiring_array'] == 5.0
@@ -14,4 +14,75 @@ def test_set():
     bh_obj = tangos.core.dictionary.get_or_create_dictionary_item(db.core.get_default_session(), "BH")
     assert bh_obj is not None
     bh_obj2 = tangos.core.dictionary.get_or_create_dictionary_item(db.core.get_default_session(), "BH")
-    assert bh_obj2 is bh_obj
\ No newline at end of file
+    assert bh_obj2 is bh_obj
+
+
+def test_cache_shared_between_sessions():
+    session = db.core.Session()
+    try:
+        bh_id = tangos.core.dictionary.get_dict_id("BH", session=session)
+        assert tangos.core.dictionary._get_dict_cache_for_session(session) is \
+               tangos.core.dictionary._get_dict_cache_for_session(db.core.get_default_session())
+    finally:
+        session.close()
+    assert bh_id == tangos.core.dictionary.get_or_create_dictionary_item(db.core.get_default_session(), "BH").id
+
+
+def test_batch_create():
+    session = db.core.get_default_session()
+    items = tangos.core.dictionary.get_or_create_dictionary_items(session, ["BH", "batch_1", "batch_2", "batch_2"])
+    assert set(items.keys()) == {"BH", "batch_1", "batch_2"}
+    assert items["BH"] is tangos.core.dictionary.get_or_create_dictionary_item(session, "BH")
+    assert len(set(item.id for item in items.values())) == 3
+    for name, item in items.items():
+        assert tangos.core.dictionary.get_dict_id(name) == item.id
+
+
+def test_cache_invalidation():
+    tangos.core.dictionary.get_or_create_dictionary_item(db.core.get_default_session(), "to_be_deleted")
+    assert tangos.core.dictionary.get_dict_id("to_be_deleted", -1) != -1
+
+    session = db.core.Session()
+    try:
+        session.execute(tangos.core.dictionary.DictionaryItem.__table__.delete().where(
+            tangos.core.dictionary.DictionaryItem.text == "to_be_deleted"))
+        session.commit()
+    finally:
+        session.close()
+
+    # the deletion is spotted as soon as a new session consults the cache
+    session = db.core.Session()
+    try:
+        assert tangos.core.dictionary.get_dict_id("to_be_deleted", -1, session=session, allow_query=False) == -1
+        assert "to_be_deleted" not in tangos.core.dictionary.get_lexicon(session)
+    finally:
+        session.close()
+
+
+def test_batch_create_after_partial_race():
+    # another process creates one of the names between the query for existing items and the commit
+    session = db.core.Session()
+    try:
+        session.add(tangos.core.dictionary.DictionaryItem("race_1"))
+        session.commit()
+    finally:
+        session.close()
+
+    original_query = tangos.core.dictionary._query_dictionary_items
+    calls = []
+    def query_missing_race_1_at_first(session, names):
+        results = original_query(session, names)
+        if len(calls)==0:
+            results.pop("race_1", None)
+        calls.append(names)
+        return results
+
+    tangos.core.dictionary._query_dictionary_items = query_missing_race_1_at_first
+    try:
+        items = tangos.core.dictionary.get_or_create_dictionary_items(db.core.get_default_session(),
+                                                                       ["race_1", "race_2"])
+    finally:
+        tangos.core.dictionary._query_dictionary_items = original_query
+
+    assert set(items.keys()) == {"race_1", "race_2"}
+    assert tangos.core.dictionary.get_dict_id("race_2") == items["race_2"].id
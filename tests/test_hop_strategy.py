@@ -356,3 +356,166 @@ def test_earliest_no_ancestor():
     earliest = no_ancestor.earliest
     assert earliest==no_ancestor
 
+
+def _strategy_results_with_both_engines(construct_strategy, engine_config='multihop_recursive_query',
+                                        engine_available='_recursive_query_available'):
+    results = []
+    for use_engine in False, True:
+        old_setting = getattr(tangos.config, engine_config)
+        setattr(tangos.config, engine_config, use_engine)
+        try:
+            strategy = construct_strategy()
+            assert getattr(strategy, engine_available)() == use_engine
+            results.append([(link.halo_from_id, link.halo_to_id, link.weight, link.nhops)
+                            for link in strategy._get_query_all()])
+        finally:
+            setattr(tangos.config, engine_config, old_setting)
+    return results
+
+def test_recursive_query_engine():
+    I = tangos.get_item
+    for construct_strategy in [
+        lambda: halo_finding.MultiHopMajorProgenitorsStrategy(I("sim/ts3/1"), include_startpoint=True),
+        lambda: halo_finding.MultiHopMajorProgenitorsStrategy(I("sim/ts3/1"), 1),
+        lambda: halo_finding.MultiHopMajorDescendantsStrategy(I("sim/ts1/2"), include_startpoint=True),
+        lambda: halo_finding.MultiHopMajorDescendantsStrategy(I("sim/ts1/1"), combine_routes=False)]:
+        hop_by_hop_results, recursive_results = _strategy_results_with_both_engines(construct_strategy)
+        assert len(hop_by_hop_results)>0
+        assert hop_by_hop_results == recursive_results
+
+def test_recursive_query_engine_not_used():
+    I = tangos.get_item
+    assert not halo_finding.MultiHopStrategy(I("sim/ts2/2"), directed='across')._recursive_query_available()
+    assert not halo_finding.MultiHopStrategy(I("sim/ts2/2"))._recursive_query_available()
+    # follow every link from each halo, so that the number of routes could grow exponentially
+    assert not halo_finding.MultiHopStrategy(I("sim/ts3/1"), 2, 'backwards')._recursive_query_available()
+    assert not halo_finding.MultiHopAllProgenitorsStrategy(I("sim/ts3/1"))._recursive_query_available()
+    # overrides a step of the hop-by-hop engine
+    assert not halo_finding.MultiHopMostRecentMergerStrategy(I("sim/ts3/1"))._recursive_query_available()
+
+def test_link_graph_engine():
+    I = tangos.get_item
+    for construct_strategy in [
+        lambda: halo_finding.MultiHopStrategy(I("sim/ts3/1"), 2, 'backwards', order_by=["time_asc", "weight"]),
+        lambda: halo_finding.MultiHopStrategy(I("sim/ts3/1"), 2, 'backwards', order_by=["time_asc", "weight"],
+                                              combine_routes=False),
+        lambda: halo_finding.MultiHopStrategy(I("sim/ts1/1"), 5, 'forwards', include_startpoint=True),
+        lambda: halo_finding.MultiHopMajorProgenitorsStrategy(I("sim/ts3/1"), include_startpoint=True),
+        lambda: halo_finding.MultiHopMajorDescendantsStrategy(I("sim/ts1/2"), include_startpoint=True),
+        lambda: halo_finding.MultiHopAllProgenitorsStrategy(I("sim/ts3/1")),
+        lambda: halo_finding.multi_source.MultiSourceAllMajorProgenitorsStrategy(
+            tangos.get_items(["sim/ts3/1", "sim/ts3/2"]))]:
+        hop_by_hop_results, graph_results = _strategy_results_with_both_engines(construct_strategy, 'use_link_graph',
+                                                                                '_link_graph_available')
+        assert len(hop_by_hop_results)>0
+        assert hop_by_hop_results == graph_results
+
+    old_setting = tangos.config.use_link_graph
+    tangos.config.use_link_graph = True
+    try:
+        test_multisource_with_nones()
+        test_multisource_preserves_order()
+        test_multisource_backwards()
+        test_multisource_forwards()
+    finally:
+        tangos.config.use_link_graph = old_setting
+
+def test_link_graph_updated():
+    from tangos.relation_finding import link_graph
+    generator = tangos.testing.simulation_generator.TestSimulationGenerator("sim_graph_update")
+    generator.add_timestep()
+    generator.add_objects_to_timestep(2)
+    generator.add_timestep()
+    generator.add_objects_to_timestep(2)
+
+    session = tangos.get_default_session()
+    sim_id = tangos.get_simulation("sim_graph_update").id
+    graph = link_graph.get_link_graph(session, sim_id)
+    assert graph is link_graph.get_link_graph(session, sim_id)
+    assert len(graph.link_to)==0
+
+    generator.link_last_halos()
+    updated_graph = link_graph.get_link_graph(session, sim_id)
+    assert updated_graph is not graph
+    assert len(updated_graph.link_to)==4 # forwards and backwards links for each halo
+
+    position, link = updated_graph.links_from(updated_graph.node_index([tangos.get_item("sim_graph_update/ts2/1").id,
+                                                                        -1]))
+    assert (position==0).all()
+    assert updated_graph.node_halo_id[updated_graph.link_to[link]].tolist()==[tangos.get_item("sim_graph_update/ts1/1").id]
+
+    # remove the earliest link, so that the maximum link id is unchanged
+    halo_ids = [int(i) for i in updated_graph.node_halo_id]
+    earliest_link = session.query(tangos.core.HaloLink).filter(tangos.core.HaloLink.halo_from_id.in_(halo_ids)).\
+        order_by(tangos.core.HaloLink.id).first()
+    session.delete(earliest_link)
+    session.commit()
+    graph_after_removal = link_graph.get_link_graph(session, sim_id)
+    assert graph_after_removal is not updated_graph
+    assert len(graph_after_removal.link_to)==3
+
+def test_main_branch_index():
+    from tangos.tools import main_branch_builder
+    session = tangos.get_default_session()
+    sim = tangos.get_simulation("sim")
+    main_branch_builder.build_main_branches(session, sim)
+    assert tangos.core.main_branch.main_branch_index_is_current(session, sim.id)
+
+    for ts in sim.timesteps:
+        for halo in ts.objects.all():
+            for nhops_max in 1, 100:
+                construct_strategy = lambda: halo_finding.MultiHopMajorProgenitorsStrategy(halo, nhops_max,
+                                                                                           include_startpoint=True)
+                hop_results, index_results = _strategy_results_with_both_engines(construct_strategy,
+                                                                                 'use_main_branch_index',
+                                                                                 '_main_branch_index_available')
+                assert hop_results == index_results
+
+    assert list(tangos.get_item("sim/ts3/1").calculate_for_progenitors("halo_number()")[0]) == [1, 1, 2]
+    assert not halo_finding.MultiHopMajorProgenitorsStrategy(tangos.get_item("sim/ts3/1"), target=None,
+                                                             one_simulation=False)._main_branch_index_available()
+
+def test_main_branch_index_outdated():
+    from tangos.tools import main_branch_builder
+    generator = tangos.testing.simulation_generator.TestSimulationGenerator("sim_branch_update")
+    generator.add_timestep()
+    generator.add_objects_to_timestep(2)
+    generator.add_timestep()
+    generator.add_objects_to_timestep(2)
+
+    session = tangos.get_default_session()
+    sim = tangos.get_simulation("sim_branch_update")
+    main_branch_builder.build_main_branches(session, sim)
+    strategy = halo_finding.MultiHopMajorProgenitorsStrategy(tangos.get_item("sim_branch_update/ts2/1"))
+    assert strategy._main_branch_index_available()
+    assert strategy.all() == []
+
+    generator.link_last_halos()
+    assert not tangos.core.main_branch.main_branch_index_is_current(session, sim.id)
+    testing.assert_halolists_equal(
+        halo_finding.MultiHopMajorProgenitorsStrategy(tangos.get_item("sim_branch_update/ts2/1")).all(),
+        ["sim_branch_update/ts1/1"])
+
+    main_branch_builder.build_main_branches(session, sim)
+    strategy = halo_finding.MultiHopMajorProgenitorsStrategy(tangos.get_item("sim_branch_update/ts2/1"))
+    assert strategy._main_branch_index_available()
+    testing.assert_halolists_equal(strategy.all(), ["sim_branch_update/ts1/1"])
+
+    # removing links must also invalidate the index, even when a later link (here, in another simulation)
+    # remains
+    generator_other = tangos.testing.simulation_generator.TestSimulationGenerator("sim_branch_update_other")
+    generator_other.add_timestep()
+    generator_other.add_objects_to_timestep(1)
+    generator_other.add_timestep()
+    generator_other.add_objects_to_timestep(1)
+    generator_other.link_last_halos()
+    main_branch_builder.build_main_branches(session, sim)
+    assert tangos.core.main_branch.main_branch_index_is_current(session, sim.id)
+
+    halo_ids = session.query(tangos.core.Halo.id).join(tangos.core.TimeStep).\
+        filter(tangos.core.TimeStep.simulation_id==sim.id)
+    session.query(tangos.core.HaloLink).filter(tangos.core.HaloLink.halo_from_id.in_(halo_ids)).\
+        delete(synchronize_session=False)
+    session.commit()
+    assert not tangos.core.main_branch.main_branch_index_is_current(session, sim.id)
+    assert halo_finding.MultiHopMajorProgenitorsStrategy(tangos.get_item("sim_branch_update/ts2/1")).all() == []
@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 import numpy as np
+import sqlalchemy
 from nose.tools import assert_raises
 
 import tangos as db
@@ -213,6 +214,27 @@ def test_calculate_array_element():
     assert h.calculate("test_array[1]")==6
 
 
+def test_calculate_without_preloaded_properties():
+    session = tangos.core.Session()
+    try:
+        halos = session.query(tangos.core.halo.Halo).filter_by(halo_number=1).all()
+        assert 'all_properties' in sqlalchemy.inspect(halos[0]).unloaded
+        values = lc.parser.parse_property_name("dummy_property_1").values(halos)
+        assert (values[0,0]==np.arange(0,100.0)).all()
+        # halos without the property give None
+        assert sum([v is None for v in values[0]])==len(halos)-1
+    finally:
+        session.close()
+
+def test_property_index_updates():
+    h = tangos.get_halo("sim/ts1/2")
+    h['index_test_1'] = 1.0
+    assert h.calculate("index_test_1")==1.0
+    h['index_test_2'] = 2.0
+    assert h.calculate("index_test_2")==2.0
+    assert h.calculate("index_test_1")==1.0
+    tangos.get_default_session().commit()
+
 def test_reassembly():
     h = tangos.get_halo("sim/ts1/1")
     h['dummy_property_with_reassembly']=101
@@ -7,6 +7,7 @@ import tangos
 import sys
 import time
 from six.moves import range
+import numpy.testing as npt
 
 def setup():
     pt.use("multiprocessing")
@@ -145,4 +146,118 @@ def _test_shared_locks_in_queue():
 
 def test_shared_locks():
     pt.launch(_test_shared_locks,4)
-    pt.launch(_test_shared_locks_in_queue, 6)
\ No newline at end of file
+    pt.launch(_test_shared_locks_in_queue, 6)
+
+def _test_async_writer():
+    from tangos.parallel_tasks import async_writer
+    sent = []
+    for i in pt.distributed(list(range(1,10))):
+        sent.append(i)
+        async_writer.queue_for_writing([(tangos.get_halo(i), 'async_test_property', float(i)),
+                                        (tangos.get_halo(i), 'async_test_link', tangos.get_halo(10-i))])
+    async_writer.flush()
+    # after flushing, everything this rank sent must be visible
+    tangos.core.get_default_session().rollback()
+    for i in sent:
+        assert tangos.get_halo(i)['async_test_property']==float(i)
+
+def test_async_writer():
+    pt.launch(_test_async_writer, 3)
+    for i in range(1,10):
+        assert tangos.get_halo(i)['async_test_property']==float(i)
+        assert tangos.get_halo(i)['async_test_link']==tangos.get_halo(10-i)
+
+def _test_chunked_jobs():
+    # expensive jobs should be handed out first
+    received = list(pt.distributed(list(range(1,10)), costs=list(range(1,10))))
+    assert received==sorted(received, reverse=True)
+    for i in received:
+        with pt.ExclusiveLock("lock"):
+            tangos.get_halo(i)['chunked_job_count'] = tangos.get_halo(i).get('chunked_job_count', 0)+1
+            tangos.core.get_default_session().commit()
+
+def test_chunked_jobs():
+    for chunk_factor in 2, None:
+        old_chunk_factor = tangos.config.parallel_job_chunk_factor
+        tangos.config.parallel_job_chunk_factor = chunk_factor
+        try:
+            pt.launch(_test_chunked_jobs, 3)
+        finally:
+            tangos.config.parallel_job_chunk_factor = old_chunk_factor
+    for i in range(1,10):
+        assert tangos.get_halo(i)['chunked_job_count']==2
+
+def test_async_writer_refused_without_thread_support():
+    from tangos.parallel_tasks import async_writer
+
+    class _Backend(object):
+        @staticmethod
+        def supports_threads():
+            return False
+
+    old_backend = pt.backend
+    pt.backend = _Backend()
+    try:
+        with npt.assert_raises(RuntimeError):
+            async_writer.queue_for_writing([(1, 'async_test_property', 1.0)])
+    finally:
+        pt.backend = old_backend
+
+def _chunk_sizes(n_jobs, costs=None):
+    from tangos.parallel_tasks import jobs
+
+    class _Backend(object):
+        @staticmethod
+        def size():
+            return 3
+
+    old_backend = pt.backend
+    pt.backend = _Backend()
+    try:
+        jobs.MessageStartIteration((n_jobs, costs)).process()
+        sizes = []
+        while jobs.current_job is not None:
+            sizes.append(jobs._next_chunk_size())
+            jobs.current_job+=sizes[-1]
+            if jobs.current_job==jobs.num_jobs:
+                jobs.current_job = jobs.num_jobs = None
+    finally:
+        pt.backend = old_backend
+    return sizes
+
+def test_chunk_sizes():
+    sizes = _chunk_sizes(100)
+    assert sum(sizes)==100
+    assert sizes[0]==25 # a quarter of the jobs: half of a fair share for each of two workers
+    assert sizes==sorted(sizes, reverse=True)
+    assert sizes[-1]==1
+
+def test_chunk_sizes_zero_costs():
+    # jobs with no cost must still be spread between the workers, rather than handed out in one chunk
+    sizes = _chunk_sizes(1000, [0]*1000)
+    assert sizes==_chunk_sizes(1000)
+
+    sizes = _chunk_sizes(1000, [1000]*10+[0]*990)
+    assert sum(sizes)==1000
+    assert max(sizes)<990//2
+
+def _test_numpy_transfer():
+    import numpy as np
+    if pt.backend.rank()==1:
+        pt.backend.send_numpy_array(np.arange(100000, dtype=np.float32).reshape(1000,100), 2)
+        pt.backend.send_numpy_array(np.arange(10), 2)
+    elif pt.backend.rank()==2:
+        large = pt.backend.receive_numpy_array(1)
+        small = pt.backend.receive_numpy_array(1)
+        assert large.dtype==np.float32 and large.shape==(1000,100)
+        assert (large.ravel()==np.arange(100000)).all()
+        assert (small==np.arange(10)).all()
+
+def test_shared_memory_backend():
+    pt.use("shared_memory")
+    try:
+        pt.launch(_add_two_properties_different_ranges, 3)
+        pt.launch(_test_numpy_transfer, 3)
+        pt.launch(_test_empty_then_non_empty_loop, 3)
+    finally:
+        pt.use("multiprocessing")
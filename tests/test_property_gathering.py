@@ -249,4 +249,48 @@ def test_missing_or_broken_class():
     with warnings.catch_warnings(record=True) as w:
         brokenclass, = ts.calculate_all("brokenproperty")
     npt.assert_allclose(noclass, [0., 10., 20., 30.])
-    assert len(w)>0
\ No newline at end of file
+    assert len(w)>0
+
+
+def _calculate_all_without_fast_path(ts, *plist, **kwargs):
+    old_setting = tangos.config.calculate_all_fast_path
+    tangos.config.calculate_all_fast_path = False
+    try:
+        return ts.calculate_all(*plist, **kwargs)
+    finally:
+        tangos.config.calculate_all_fast_path = old_setting
+
+
+def test_scalar_fast_path():
+    from tangos.live_calculation import scalar_fast_path
+    ts = tangos.get_timestep("sim/ts2")
+    for plist, kwargs in [(("Mvir",), {}),
+                          (("Mvir", "Rvir"), {}),
+                          (("Mvir/Rvir", "Mvir>5", "!(Mvir>5)", "log10(Mvir)"), {}),
+                          (("Mvir*2+1", "Rvir**2"), {'limit': 3}),
+                          (("hole_mass", "hole_spin-hole_mass"), {}),
+                          (("Mvir", "hole_mass"), {}),
+                          (("hole_mass",), {'object_typetag': 'BH'})]:
+        assert scalar_fast_path.calculate_all(ts, live_calculation.parser.parse_property_names(*plist)) is not None
+        fast = ts.calculate_all(*plist, **kwargs)
+        slow = _calculate_all_without_fast_path(ts, *plist, **kwargs)
+        assert len(fast)==len(slow)
+        for fast_i, slow_i in zip(fast, slow):
+            assert fast_i.dtype==slow_i.dtype
+            npt.assert_array_equal(fast_i, slow_i)
+
+
+def test_scalar_fast_path_fallback():
+    from tangos.live_calculation import scalar_fast_path
+    # use a separate simulation, so that the array property does not appear in the other tests
+    creator = tangos.testing.simulation_generator.TestSimulationGenerator("sim_fast_path_fallback")
+    creator.add_timestep()
+    creator.add_objects_to_timestep(4)
+    creator.add_properties_to_halos(Mvir=lambda i: float(i), array_property=lambda i: np.arange(3))
+    tangos.get_default_session().commit()
+    ts = tangos.get_timestep("sim_fast_path_fallback/ts1")
+    for property_name in "array_property", "Mvir+array_property", "dbid()", "non_existent_property":
+        calculation = live_calculation.parser.parse_property_names(property_name)
+        assert scalar_fast_path.calculate_all(ts, calculation) is None
+
+    npt.assert_allclose(ts.calculate_all("array_property")[0], [np.arange(3)]*4)
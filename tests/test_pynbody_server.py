@@ -86,6 +86,26 @@ def _test_nonexistent_array():
 def test_nonexistent_array():
     pt.launch(_test_nonexistent_array, 2)
 
+def _test_batched_arrays():
+    test_filter = pynbody.filt.Sphere('5000 kpc')
+    conn = ps.RemoteSnapshotConnection(handler, "tiny.000640")
+    f = conn.get_view(test_filter)
+    f_local = pynbody.load(tangos.config.base+"test_simulations/test_tipsy/tiny.000640")[test_filter]
+    f_local.physical_units()
+
+    f.load_arrays(['pos', 'vel', 'mass', 'iord'])
+    for name in 'pos', 'vel', 'mass', 'iord':
+        assert name in f.keys()
+        assert (f[name] == f_local[name]).all()
+
+    # a missing array is reported, but the other arrays in the batch still arrive
+    with npt.assert_raises(IOError):
+        f.load_arrays(['nonexistent', 'temp'], fam=pynbody.family.gas)
+    assert (f.gas['temp'] == f_local.gas['temp']).all()
+
+def test_batched_arrays():
+    pt.launch(_test_batched_arrays, 2)
+
 
 def _test_halo_array():
     conn = ps.RemoteSnapshotConnection(handler, "tiny.000640")
@@ -166,4 +186,24 @@ def test_correct_object_loading():
     """This regression test looks for a bug where the pynbody_server module assumed halos could be
     loaded just by calling f.halos() where f was the SimSnap. This is not true in general; for example,
     for SubFind catalogues one has both halos and groups and the correct arguments must be passed."""
-    pt.launch(_test_correct_object_loading, 2)
\ No newline at end of file
+    pt.launch(_test_correct_object_loading, 2)
+
+def _test_multiple_snapshots_resident():
+    test_filter = pynbody.filt.Sphere('5000 kpc')
+    fname = ["tiny.000640", "tiny.000832"][pt.backend.rank()-1]
+    conn = ps.RemoteSnapshotConnection(handler, fname)
+    # both clients must be connected at once to get past the barrier
+    pt.barrier()
+    f = conn.get_view(test_filter)
+    f_local = pynbody.load(tangos.config.base+"test_simulations/test_tipsy/"+fname)[test_filter]
+    f_local.physical_units()
+    assert (f['pos'] == f_local['pos']).all()
+    conn.disconnect()
+
+def test_multiple_snapshots_resident():
+    old_max_snapshots = tangos.config.pynbody_server_max_snapshots
+    tangos.config.pynbody_server_max_snapshots = 2
+    try:
+        pt.launch(_test_multiple_snapshots_resident, 3)
+    finally:
+        tangos.config.pynbody_server_max_snapshots = old_max_snapshots